@@ -1,23 +1,81 @@
 import os
 import sys
 import time
+IMPORT_STARTED = time.perf_counter()
 import json
-import tkinter as tk
-from tkinter import scrolledtext, filedialog, messagebox
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-import google.generativeai as genai
-from PIL import Image
+import importlib
+import functools
+import heapq
+import itertools
+import re
+import math
+import unicodedata
+import shutil
+import subprocess
+try:
+    from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+except ImportError:  # browser-free modes (--mock-llm, --benchmark, --eval-classifier) run without selenium
+    class TimeoutException(Exception):
+        pass
+
+    class StaleElementReferenceException(Exception):
+        pass
 import io
 import traceback
+import base64
+import argparse
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import random
 import hashlib
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+
+class LazyImport:
+    """Stand-in for a module (or one of its attributes) that is imported on first use"""
+
+    timings = {}  # module name -> seconds spent importing it
+
+    def __init__(self, module, attr=None):
+        self._module = module
+        self._attr = attr
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            started = time.perf_counter()
+            target = importlib.import_module(self._module)
+            if self._attr:
+                target = getattr(target, self._attr)
+            LazyImport.timings.setdefault(self._module, time.perf_counter() - started)
+            self._target = target
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+# Heavy dependencies load when first touched, so --mock-llm, --benchmark and a
+# remembered-model start never pay for the ones they do not use
+tk = LazyImport("tkinter")
+scrolledtext = LazyImport("tkinter.scrolledtext")
+filedialog = LazyImport("tkinter.filedialog")
+messagebox = LazyImport("tkinter.messagebox")
+webdriver = LazyImport("selenium.webdriver")
+By = LazyImport("selenium.webdriver.common.by", "By")
+Keys = LazyImport("selenium.webdriver.common.keys", "Keys")
+WebDriverWait = LazyImport("selenium.webdriver.support.ui", "WebDriverWait")
+Service = LazyImport("selenium.webdriver.chrome.service", "Service")
+Options = LazyImport("selenium.webdriver.chrome.options", "Options")
+ChromeDriverManager = LazyImport("webdriver_manager.chrome", "ChromeDriverManager")
+genai = LazyImport("google.generativeai")
+Image = LazyImport("PIL.Image")
 
 # ANSI Color codes for terminal
 class Colors:
@@ -30,10 +88,31 @@ class Colors:
     BOLD = '\033[1m'
     RESET = '\033[0m'
 
+def cosmetic(animation):
+    """Skip an animation when nobody is watching a terminal, and clock it when it does run"""
+    @functools.wraps(animation)
+    def wrapper(*args, **kwargs):
+        if not LoadingAnimation.enabled():
+            return None
+        started = time.perf_counter()
+        try:
+            return animation(*args, **kwargs)
+        finally:
+            LoadingAnimation.spent += time.perf_counter() - started
+    return wrapper
+
 class LoadingAnimation:
     """Enhanced loading animations with matrix-style effects"""
 
+    spent = 0.0  # seconds spent animating, kept out of the startup phase timings
+
     @staticmethod
+    def enabled():
+        """Animations only make sense on an interactive terminal (set REPLIQ_NO_ANIMATIONS=1 to skip them anyway)"""
+        return sys.stdout.isatty() and not os.environ.get("REPLIQ_NO_ANIMATIONS")
+
+    @staticmethod
+    @cosmetic
     def show_boot_sequence():
         """Show RepliQ boot sequence with aesthetic animations"""
         messages = [
@@ -57,6 +136,7 @@ class LoadingAnimation:
                 time.sleep(0.2)
 
     @staticmethod
+    @cosmetic
     def show_loading_bar(duration=3):
         """Show animated loading bar with internet speed"""
         print(f"\n{Colors.CYAN}[CONNECTING TO MODULES]{Colors.RESET}")
@@ -78,6 +158,7 @@ class LoadingAnimation:
         sys.stdout.flush()
 
     @staticmethod
+    @cosmetic
     def show_authenticator():
         """Show authenticator animation"""
         print(f"{Colors.CYAN}[AUTHENTICATOR SEQUENCE]{Colors.RESET}")
@@ -96,19 +177,2011 @@ class LoadingAnimation:
             sys.stdout.flush()
             time.sleep(0.5)
 
+# Shared bubble parser: one DOM walk per message, no per-element WebDriver calls.
+# data-pre-plain-text looks like "[10:32, 12/01/2024] Name: "
+MESSAGE_PARSER_JS = """
+function repliqRow(el) {
+    return el.closest('[data-id]') || el;
+}
+
+function repliqList() {
+    // Cached parent of the message rows, re-resolved only when the chat pane changes
+    var main = document.querySelector('#main');
+    if (!main) { return null; }
+    var cached = window.__repliqList;
+    if (cached && cached.isConnected && main.contains(cached)) { return cached; }
+    var first = main.querySelector('.message-in, .message-out');
+    var item = first ? (first.closest('[role="row"]') || repliqRow(first)) : null;
+    window.__repliqList = item ? item.parentElement : null;
+    return window.__repliqList;
+}
+
+function repliqTail(stopId, limit) {
+    // Walks back from the newest row, so cost depends on `limit`, not chat length
+    var list = repliqList();
+    var rows = [];
+    var found = false;
+    for (var child = list ? list.lastElementChild : null; child && rows.length < limit; child = child.previousElementSibling) {
+        var row = child.hasAttribute('data-id') ? child : child.querySelector('[data-id]');
+        if (!row || !(row.matches('.message-in, .message-out') || row.querySelector('.message-in, .message-out'))) { continue; }
+        if (stopId && row.getAttribute('data-id') === stopId) { found = true; break; }
+        rows.push(row);
+    }
+    rows.reverse();
+    return {rows: rows, found: found};
+}
+
+function repliqChatTitle() {
+    var title = document.querySelector('#main header span[title]');
+    return title ? title.getAttribute('title') : '';
+}
+
+function repliqParse(row) {
+    var bubble = row.matches('.message-in, .message-out') ? row : row.querySelector('.message-in, .message-out');
+    var spans = row.querySelectorAll('span.selectable-text');
+    var parts = [];
+    spans.forEach(function (s) { var t = s.innerText.trim(); if (t) { parts.push(t); } });
+    var metaEl = row.querySelector('[data-pre-plain-text]');
+    var meta = metaEl ? metaEl.getAttribute('data-pre-plain-text') : '';
+    var match = /^\\[([^\\]]*)\\]\\s*([^:]*):/.exec(meta);
+    return {
+        direction: bubble && bubble.classList.contains('message-out') ? 'out' : 'in',
+        id: row.getAttribute('data-id') || '',
+        text: parts.length ? parts.join(' ') : row.innerText.trim(),
+        timestamp: match ? match[1] : '',
+        sender: match ? match[2].trim() : '',
+        // Photo, video or GIF in the bubble itself (emoji images are not blob: URLs)
+        media: !!row.querySelector('img[src^="blob:"], video, [data-icon="media-play"], [data-icon="media-gif"]')
+    };
+}
+"""
+
+# Page-side intake: a MutationObserver queues new incoming bubbles so Python
+# only has to drain the queue instead of re-scanning the DOM every few seconds
+MESSAGE_OBSERVER_JS = MESSAGE_PARSER_JS + """
+if (window.__repliqObserver) { return true; }
+
+window.__repliqQueue = [];
+window.__repliqWaiters = [];
+window.__repliqSeen = new Set();
+window.__repliqMain = document.querySelector('#main');
+window.__repliqSettleUntil = 0;
+
+function repliqMarkSeen(root) {
+    root.querySelectorAll('[data-id]').forEach(function (r) {
+        window.__repliqSeen.add(r.getAttribute('data-id'));
+    });
+}
+
+function repliqIsTail(row) {
+    // Older history loaded on scroll is inserted *before* rows we've already seen
+    var next = row.nextElementSibling;
+    for (var i = 0; next && i < 3; i++, next = next.nextElementSibling) {
+        var id = next.getAttribute('data-id');
+        if (id && window.__repliqSeen.has(id)) { return false; }
+    }
+    return true;
+}
+
+function repliqIsLast(row) {
+    var list = repliqList();
+    var last = list ? list.lastElementChild : null;
+    return !!last && (last === row || last.contains(row));
+}
+
+function repliqFlush() {
+    if (!window.__repliqQueue.length) { return; }
+    var waiters = window.__repliqWaiters;
+    window.__repliqWaiters = [];
+    var batch = window.__repliqQueue;
+    window.__repliqQueue = [];
+    waiters.forEach(function (w) { w(batch); });
+    if (!waiters.length) { window.__repliqQueue = batch; }
+}
+
+repliqMarkSeen(document);
+
+window.__repliqObserver = new MutationObserver(function (mutations) {
+    var main = document.querySelector('#main');
+    if (main !== window.__repliqMain) {
+        // Chat switched: the rows on screen right now are history, not news
+        window.__repliqMain = main;
+        window.__repliqSettleUntil = Date.now() + 1500;
+        if (main) { repliqMarkSeen(main); }
+        return;
+    }
+    var added = [];
+    var bubbles = [];
+    mutations.forEach(function (m) {
+        m.addedNodes.forEach(function (node) {
+            if (node.nodeType !== 1) { return; }
+            added.push(node);
+            (node.matches('.message-in') ? [node] : node.querySelectorAll('.message-in')).forEach(function (b) {
+                var row = repliqRow(b);
+                var id = row.getAttribute('data-id');
+                if (!(id && window.__repliqSeen.has(id)) && bubbles.indexOf(row) === -1) { bubbles.push(row); }
+            });
+        });
+    });
+    if (Date.now() < window.__repliqSettleUntil && !(bubbles.length === 1 && repliqIsLast(bubbles[0]))) {
+        // The chat just opened is still rendering its history in bulk; only a lone
+        // bubble appended at the very end is a live message
+        added.forEach(function (node) {
+            if (node.hasAttribute('data-id')) { window.__repliqSeen.add(node.getAttribute('data-id')); }
+            repliqMarkSeen(node);
+        });
+        return;
+    }
+    bubbles.forEach(function (row) {
+        var id = row.getAttribute('data-id');
+        if (!repliqIsTail(row)) { if (id) { window.__repliqSeen.add(id); } return; }
+        if (id) { window.__repliqSeen.add(id); }
+        var msg = repliqParse(row);
+        msg.detected_at = Date.now();
+        msg.chat = repliqChatTitle();
+        window.__repliqQueue.push(msg);
+    });
+    repliqFlush();
+});
+window.__repliqObserver.observe(document.body, {childList: true, subtree: true});
+return true;
+"""
+
+# Long-poll: resolves as soon as the observer queues something, or with an
+# empty list after the timeout. Resolves null if the observer is gone (reload)
+WAIT_FOR_MESSAGES_JS = """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[0];
+if (!window.__repliqObserver) { done(null); return; }
+if (window.__repliqQueue.length) {
+    var batch = window.__repliqQueue;
+    window.__repliqQueue = [];
+    done(batch);
+    return;
+}
+var finished = false;
+var waiter = function (batch) { if (!finished) { finished = true; done(batch); } };
+window.__repliqWaiters.push(waiter);
+setTimeout(function () {
+    if (finished) { return; }
+    finished = true;
+    window.__repliqWaiters = window.__repliqWaiters.filter(function (w) { return w !== waiter; });
+    done([]);
+}, timeoutMs);
+"""
+
+# Batched extraction: the last N bubbles of the open chat in one roundtrip
+EXTRACT_MESSAGES_JS = MESSAGE_PARSER_JS + """
+return repliqTail(null, arguments[0]).rows.map(repliqParse);
+"""
+
+# Anchored scan: only the rows after the last data-id we've seen in this chat
+SCAN_NEW_MESSAGES_JS = MESSAGE_PARSER_JS + """
+var tail = repliqTail(arguments[0], arguments[1]);
+return {
+    chat: repliqChatTitle(),
+    found: tail.found,
+    messages: tail.rows.map(repliqParse)
+};
+"""
+
+# Chat list: unread badges are the only thing we read, and an observer on the
+# pane lets Python sleep until the list actually changes
+CHAT_LIST_HELPERS_JS = """
+function repliqChatPane() {
+    return document.querySelector("[data-testid='chat-list']") || document.querySelector('#pane-side');
+}
+
+function repliqUnreadChats() {
+    var pane = repliqChatPane();
+    var chats = [];
+    window.__repliqUnreadItems = {};
+    if (!pane) { return chats; }
+    pane.querySelectorAll('span[aria-label*="unread"]').forEach(function (badge) {
+        var item = badge.closest('[role="listitem"], [role="row"]');
+        var title = item ? item.querySelector('span[title]') : null;
+        if (!title) { return; }
+        var name = title.getAttribute('title');
+        window.__repliqUnreadItems[name] = item;
+        chats.push({title: name, unread: parseInt(badge.innerText, 10) || 1});
+    });
+    return chats;
+}
+"""
+
+CHAT_LIST_OBSERVER_JS = CHAT_LIST_HELPERS_JS + """
+var pane = repliqChatPane();
+if (!pane) { return false; }
+if (window.__repliqChatObserver && window.__repliqChatPane === pane) { return true; }
+if (window.__repliqChatObserver) { window.__repliqChatObserver.disconnect(); }
+window.__repliqChatPane = pane;
+window.__repliqChatDirty = true;
+window.__repliqChatWaiters = [];
+window.__repliqChatObserver = new MutationObserver(function () {
+    window.__repliqChatDirty = true;
+    var waiters = window.__repliqChatWaiters;
+    window.__repliqChatWaiters = [];
+    waiters.forEach(function (w) { w(); });
+});
+window.__repliqChatObserver.observe(pane, {childList: true, subtree: true, characterData: true});
+return true;
+"""
+
+# Resolves with {activity, unread} once the chat list changes (after a short
+# settle so a burst of mutations is read once), or {activity: false} on timeout
+WAIT_FOR_CHAT_ACTIVITY_JS = CHAT_LIST_HELPERS_JS + """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[0];
+if (!window.__repliqChatObserver || !window.__repliqChatPane.isConnected) { done(null); return; }
+var finish = function () {
+    window.__repliqChatDirty = false;
+    done({activity: true, unread: repliqUnreadChats()});
+};
+if (window.__repliqChatDirty) { finish(); return; }
+var finished = false;
+var waiter = function () { if (!finished) { finished = true; setTimeout(finish, 150); } };
+window.__repliqChatWaiters.push(waiter);
+setTimeout(function () {
+    if (finished) { return; }
+    finished = true;
+    window.__repliqChatWaiters = window.__repliqChatWaiters.filter(function (w) { return w !== waiter; });
+    done({activity: false, unread: []});
+}, timeoutMs);
+"""
+
+OPEN_CHAT_JS = CHAT_LIST_HELPERS_JS + """
+var name = arguments[0];
+var item = (window.__repliqUnreadItems || {})[name];
+if (!item || !item.isConnected) {
+    item = null;
+    var pane = repliqChatPane();
+    var titles = pane ? pane.querySelectorAll('span[title]') : [];
+    for (var i = 0; i < titles.length; i++) {
+        if (titles[i].getAttribute('title') === name) {
+            item = titles[i].closest('[role="listitem"], [role="row"]') || titles[i];
+            break;
+        }
+    }
+}
+if (!item) { return false; }
+var target = item.querySelector('[tabindex]') || item;
+['mousedown', 'mouseup', 'click'].forEach(function (type) {
+    target.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+});
+return true;
+"""
+
+CHAT_TITLE_JS = MESSAGE_PARSER_JS + """
+return repliqChatTitle();
+"""
+
+# Chats whose contact is typing right now: the open chat's header subtitle and
+# the chat-list previews both switch to "typing…" (markers are passed in, so
+# other UI languages can be configured)
+TYPING_CHATS_JS = MESSAGE_PARSER_JS + CHAT_LIST_HELPERS_JS + """
+var markers = arguments[0].map(function (m) { return m.toLowerCase(); });
+var chats = [];
+function repliqTyping(text, title) {
+    text = text.replace(title, '').toLowerCase();
+    return markers.some(function (m) { return text.indexOf(m) !== -1; });
+}
+var header = document.querySelector('#main header');
+if (header && repliqTyping(header.innerText, repliqChatTitle())) { chats.push(repliqChatTitle()); }
+var pane = repliqChatPane();
+if (pane) {
+    pane.querySelectorAll('[role="listitem"], [role="row"]').forEach(function (item) {
+        var title = item.querySelector('span[title]');
+        var name = title ? title.getAttribute('title') : '';
+        if (name && repliqTyping(item.innerText, name)) { chats.push(name); }
+    });
+}
+return chats;
+"""
+
+INPUT_BOX_SELECTORS = [
+    "div[contenteditable='true'][data-tab='10']",
+    "div[contenteditable='true'][role='textbox']",
+    "footer div[contenteditable='true']",
+]
+
+# Every UI element we look up, with the selector variants WhatsApp has used for it
+UI_SELECTORS = {
+    'input_box': INPUT_BOX_SELECTORS,
+    'logged_in': ["[data-testid='chat-list']", "#pane-side", "div[role='textbox']"],
+    'conversation_pane': ["#main", "div[data-testid='conversation-panel-wrapper']"],
+    'qr_code': ["canvas[aria-label*='Scan']", "div[data-ref] canvas", "[data-testid='qrcode']"],
+}
+
+# One round trip per poll while WhatsApp boots: is the chat list there yet, or is it asking for a QR scan?
+READINESS_JS = """
+var ready = arguments[0], qr = arguments[1];
+for (var i = 0; i < ready.length; i++) {
+    if (document.querySelector(ready[i])) { return {state: 'ready', selector: ready[i]}; }
+}
+for (var j = 0; j < qr.length; j++) {
+    if (document.querySelector(qr[j])) { return {state: 'qr', selector: qr[j]}; }
+}
+return {state: document.readyState === 'complete' ? 'loading' : 'booting', selector: null};
+"""
+
+class SelectorRegistry:
+    """Learned selector lookups for WhatsApp's shifting UI.
+
+    The variant that matched last time is tried first, the resolved element
+    is cached until it goes stale, and every lookup is counted per selector.
+    """
+
+    def __init__(self, variants, preferred=None):
+        self.variants = {name: list(selectors) for name, selectors in variants.items()}
+        self.preferred = {name: sel for name, sel in (preferred or {}).items() if name in self.variants}
+        self.cache = {}
+        self.stats = {}
+        self.changed = False
+
+    def ordered(self, name):
+        """Variants for `name`, last known good first"""
+        selectors = self.variants[name]
+        best = self.preferred.get(name)
+        if best in selectors:
+            return [best] + [sel for sel in selectors if sel != best]
+        return selectors
+
+    def cached(self, name):
+        """Cached element for `name`, or None"""
+        return self.cache.get(name)
+
+    def record(self, name, selector, element=None):
+        """Note that `selector` resolved `name` (and cache the element, if given)"""
+        self.count(selector, 'hits')
+        if element is not None:
+            self.cache[name] = element
+        if self.preferred.get(name) != selector:
+            self.preferred[name] = selector
+            self.changed = True
+
+    def invalidate(self, name):
+        """Forget the cached element, e.g. after StaleElementReferenceException"""
+        self.cache.pop(name, None)
+
+    def find(self, driver, name, timeout=0, displayed=True):
+        """Resolve `name` to an element, polling the variants until `timeout`; None if nothing matched"""
+        element = self.cache.get(name)
+        if element is not None:
+            try:
+                if not displayed or element.is_displayed():
+                    self.count(self.preferred.get(name), 'hits')
+                    return element
+            except StaleElementReferenceException:
+                pass
+            self.invalidate(name)
+
+        deadline = time.time() + timeout
+        first_pass = True
+        while True:
+            for selector in self.ordered(name):
+                try:
+                    candidates = driver.find_elements(By.CSS_SELECTOR, selector)
+                    element = next((el for el in candidates if not displayed or el.is_displayed()), None)
+                except StaleElementReferenceException:
+                    element = None
+                if element is not None:
+                    self.record(name, selector, element)
+                    return element
+                if first_pass:
+                    self.count(selector, 'failures')
+            first_pass = False
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.1)
+
+    def report(self):
+        """Per-selector hit/failure counters"""
+        return {sel: dict(counts) for sel, counts in self.stats.items()}
+
+    def count(self, selector, field):
+        """Bump a per-selector counter"""
+        if selector:
+            counts = self.stats.setdefault(selector, {'hits': 0, 'failures': 0})
+            counts[field] += 1
+
+# Fast send, step 1: put the whole reply into the composer in one call.
+# execCommand('insertText') goes through the editor's own input handling, so
+# WhatsApp's editor state matches what is on screen (unlike setting textContent)
+FAST_INSERT_JS = MESSAGE_PARSER_JS + """
+var selectors = arguments[0];
+var text = arguments[1];
+var box = arguments[2] || null;
+var matched = null;
+if (box && box.offsetParent === null) { box = null; }
+for (var i = 0; i < selectors.length && !box; i++) {
+    var el = document.querySelector(selectors[i]);
+    if (el && el.offsetParent !== null) { box = el; matched = selectors[i]; }
+}
+if (!box) { return {ok: false, reason: 'input box not found'}; }
+var tail = repliqTail(null, 1).rows;
+box.focus();
+document.execCommand('selectAll', false, null);
+document.execCommand('insertText', false, text);
+var typed = (box.innerText || '').trim();
+return {
+    ok: typed.length > 0,
+    reason: typed.length ? '' : 'editor did not accept the text',
+    box: box,
+    selector: matched,
+    tail: tail.length ? tail[0].getAttribute('data-id') : ''
+};
+"""
+
+# Fast send, step 2: has a new outgoing bubble replaced the old tail, and is it
+# still pending (clock icon) or sent (tick)?
+SEND_STATUS_JS = MESSAGE_PARSER_JS + """
+var rows = repliqTail(null, 1).rows;
+if (!rows.length) { return {state: 'none'}; }
+var row = rows[0];
+var id = row.getAttribute('data-id') || '';
+if (id === arguments[0] || !(row.matches('.message-out') || row.querySelector('.message-out'))) {
+    return {state: 'none'};
+}
+return {state: row.querySelector('[data-icon="msg-time"]') ? 'pending' : 'sent', id: id};
+"""
+
+class MessageIdentityIndex:
+    """Stable message identities and a bounded in-memory index of the ones seen.
+
+    A key combines chat, WhatsApp's data-id, sender and timestamp, so the
+    same text sent twice is two messages while the same bubble seen on two
+    polls is one. Lookups are O(1); the least recently seen keys fall out
+    once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_for(chat, data_id, sender="", timestamp="", text=""):
+        """Compact composite key; falls back to sender/timestamp/text when a bubble has no data-id"""
+        if data_id:
+            basis = "\x1f".join([chat or "", data_id, sender or "", timestamp or ""])
+        else:
+            basis = "\x1f".join([chat or "", "", sender or "", timestamp or "", text or ""])
+        return hashlib.blake2b(basis.encode('utf-8'), digest_size=12).hexdigest()
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return True
+            return False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key):
+        """Index `key`; returns False if it was already there"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return False
+            self.entries[key] = time.time()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+class ImageCache:
+    """Encoded training images, keyed by path + mtime + size.
+
+    Held in memory and mirrored to `cache_dir`, so neither a new reply nor a
+    restart re-decodes and re-encodes an image that hasn't changed on disk.
+    """
+
+    def __init__(self, cache_dir=".repliq_cache/images"):
+        self.cache_dir = cache_dir
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+    def get(self, image_path, encoder):
+        """Encoded bytes for `image_path`, running `encoder(image_path)` only on a miss"""
+        try:
+            info = os.stat(image_path)
+        except OSError:
+            return None
+        basis = f"{os.path.abspath(image_path)}|{info.st_mtime_ns}|{info.st_size}"
+        key = hashlib.sha1(basis.encode('utf-8')).hexdigest()
+
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.stats['memory_hits'] += 1
+                self.stats['bytes_saved'] += info.st_size
+                return data
+
+        disk_path = os.path.join(self.cache_dir, key + ".jpg")
+        if os.path.exists(disk_path):
+            with open(disk_path, 'rb') as f:
+                data = f.read()
+            with self.lock:
+                self.memory[key] = data
+                self.stats['disk_hits'] += 1
+                self.stats['bytes_saved'] += info.st_size
+            return data
+
+        data = encoder(image_path)
+        if data is None:
+            return None
+        with self.lock:
+            self.memory[key] = data
+            self.stats['misses'] += 1
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = disk_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, disk_path)
+        except OSError:
+            pass
+        return data
+
+    def hit_rate(self):
+        """Fraction of lookups served without re-encoding"""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+# Words a real message is likely to contain: common English, texting shorthand,
+# and the Hinglish/Odia the persona chats in. Also the training text for the
+# character bigram model the gibberish check scores unknown words against.
+CLASSIFIER_LEXICON = frozenset("""
+a about after again all also am an and any are around as ask at away back bad be because been before being best
+better big bit both busy but by call came can cant class come coming could cool day days did didnt do does doing
+done dont down eat eating even ever every exam fine first for free friend from fun game get give go going gone
+good got great guys had happy has have he hear hello help her here hey hi him his home how i if im in is it its
+just keep kind know last late later leave let like little lol long look lot love made make man many maybe me mean
+meet meeting miss money more morning most much my need never new next nice night no not nothing now of off oh ok
+okay on one only or other our out over people phone place play please pls probably put quick read ready real
+really right said same saw say school see seen send she should sleep so some something soon sorry still study
+sure take talk tell than thank thanks that the their them then there they thing things think this time to today
+tomorrow tonight too try two up us very wait want was watch way we week well went were what when where which who
+why will with work would wow yeah yes yet you your yours
+afk bruh brb btw bday congrats cya dm fr gg gm gn gtg hbu hmm hm hn idk ikr ily imo irl iykyk k kk lmao lmk
+lol msg nah nope np nvm ofc okk okie okiee omg ppl rn smh sry tbh thx tmrw tmr ty u ur wby wbu wtf wyd xd ya
+yaa yea yep yepp yess yo yup yupp lmfao rofl rotfl smthng smth sth nthng abt bcoz bcz coz cuz plz thnx thanx
+tysm tc ttyl hru sup wassup ngl istg jk fyi asap bff srsly prolly frnd frnds msgs txt pic pics vid gud nyt mrng
+gd sd hbd gnsd
+aaj abhi acha achha accha aur bas bata batao bhai bhi bol bolo chal chalo chal raha dekh dekho din ghar gaya
+haan hai hain haina hum jaa jaana jaanta jao kab kaha kahan kaisa kaise kal kar karo karna kuch kya kyu kyun
+main mat mera meri mujhe na nahi nahin pata phir raha rahe rahi sab sahi samjha tera teri theek thik thoda toh
+tu tum tujhe wala wo woh yaar ye yeh khaas tmkc bc mc bkl dhnyvd dhanyavad shukriya kese kaisi kyaa acchaa
+achi acha au bhala chalo ebe emiti jiba jaiba kana kahin kemiti khaili kouthi kuade mo mote nahin sathire
+tame tu tumara tora thik heba hela kariba karuchu
+able accept account act action address adjust adopt advice afraid against age agree air allow almost alone along
+already always amazing amount angry animal answer anyway apart apartment apply area argue arm army arrive art
+article attack attempt attention aunt author available avoid baby bag ball bank bar base basket bath battery beach
+bear beautiful bed beer begin behind believe below bench beside between bike bill bird birthday black blame blank
+block blood blue board boat body book boring born borrow boss bottle bottom box boy brain branch bread break
+breakfast bridge bright bring broken brother brought brown budget build building bus business buy cake camera
+camp campus car card care careful carry case cash cat catch cause chair chance change chapter charge cheap check
+chicken child children choice choose church city clean clear climb clock close clothes cloud club coach coat
+coffee cold college colour common company complete computer concept concert condition connect contact continue
+control copy corner correct corrupt cost count country couple course cousin cover crazy cream credit crime cross
+crowd cry culture cup current customer cut cycle dance danger dark date daughter dead deal dear decide deep
+degree delete depend describe design desk detail develop different difficult dinner direct dirty discuss doctor
+dog dollar door double doubt draw dream dress drink drive drop dry during dust duty early earth easy edge effect
+effort egg eight either electric else email empty end energy engine enjoy enough enter entire error escape
+evening event exact example except excited exercise expect expensive experience explain extra eye face fact fail
+fair fall family famous fan far farm fast father fault favourite fear feel few field fight figure file fill film
+final find finger finish fire fish fit five fix flat flight floor flower fly follow food foot force forest
+forget form forward four fresh fridge front fruit full future garden gas gate gift girl glass goal gold grade
+green ground group grow guess guest gun hair half hand hang happen hard hate head health heart heat heavy height
+hold holiday hope horse hospital hot hotel hour house huge human hungry hurt husband ice idea ill important
+include inside instead interest internet invite island issue item job join joke journey judge juice jump kept
+key kick kid kill kitchen knife land language large laptop laugh law lazy learn least left leg less lesson letter
+level library lie life light limit line link list listen live lock lose loud low luck lunch machine magic mail
+main manage map mark market married match matter meal measure medicine member memory message middle might mind
+minute mirror mistake mobile model moment month moon mother mountain mouth move movie music must name narrow
+nature near neck neighbour nervous network news normal north nose note notice number object obvious obtain ocean
+office often oil open order outside owner page pain paint pair paper parent park part party pass past pay peace
+pen pencil perfect perhaps period person photo pick picture piece plan plane plant plate point police polite poor
+popular possible post pound power practice prepare present press pretty price print prison private prize problem
+produce product program prompt promise protect proud prove pull purpose push question quiet rain raise reach
+reason receive record red relax remember rent repeat reply report rest result return rich ride ring rise river
+road rock room rule run sad safe salt sand save scared science score sea search season seat second secret sell
+sense sentence serious serve set seven shape share sharp shirt shoe shop short shout show shower shut sick side
+sign silly simple sing single sister sit six size skin sky slept slow small smart smell smile snow soft son song
+sound south space speak special speed spend sport spring square staff stage stand star start station stay step
+stick stomach stone stop store story straight strange street strong student stupid style subway success sugar
+suggest summer sun support surprise sweet swim system table tall taste tax tea teach teacher team teeth test text
+theatre thick thin third though throw ticket tired title together toilet top total touch tour town track traffic
+train travel tree trip trouble true trust truth turn type uncle under understand university until upset use
+usual village visit voice vote walk wall war warm wash waste water weather wedding weekend weight west wet wheel
+white whole wife wild win wind window wine winter wish woman wonder wood word world worry write wrong year young
+""".split())
+
+# Labeled messages for `--eval-classifier`: ('gibberish' | 'emoji' | 'normal', text).
+# This is the tuning set: the lexicon and thresholds were chosen against it
+CLASSIFIER_CORPUS = [
+    ('gibberish', "iuafgiudfirhuihccgh"), ('gibberish', "asdfghjkl"), ('gibberish', "qwertyuiop"),
+    ('gibberish', "jkdfhgjkdfhg"), ('gibberish', "sdkjfhskdjfh"), ('gibberish', "xzcvbnm"),
+    ('gibberish', "ghfjdkslaq"), ('gibberish', "lkjhgfdsa"), ('gibberish', "wqeoiruty"),
+    ('gibberish', "bvncmxz"), ('gibberish', "aksjdhaksjd"), ('gibberish', "fjfjfjdkdk"),
+    ('gibberish', "ppoiuytrewq"), ('gibberish', "zxcvzxcv"), ('gibberish', "hjkhjkhjk"),
+    ('gibberish', "dfgdfgdfg"), ('gibberish', "kjsdf kjsdf"), ('gibberish', "uhsdufhsduhf"),
+    ('gibberish', "qazwsxedc"), ('gibberish', "plmoknijb"), ('gibberish', "nvjfkdlsoe"),
+    ('gibberish', "gggggh fjfjf"), ('gibberish', "sdfsdf sdfsdf"), ('gibberish', "ijfoiwejfoiwej"),
+    ('gibberish', "vhjvhjbjk"), ('gibberish', "ncjdncjdn"), ('gibberish', "oiuoiuoiu"),
+    ('gibberish', "hdhdhdjdjd"), ('gibberish', "wkwkwkwkd"), ('gibberish', "jdjdjjdjsj"),
+    ('emoji', "😂"), ('emoji', "😂😂😂"), ('emoji', "👍"), ('emoji', "❤️"), ('emoji', "🙏🏽"),
+    ('emoji', "👀"), ('emoji', "🔥🔥"), ('emoji', "😭😭"), ('emoji', "🤣 🤣"), ('emoji', "👋😊"),
+    ('emoji', "🥺"), ('emoji', "💯!!"), ('emoji', "👨‍👩‍👧"), ('emoji', "🤦‍♂️"),
+    ('normal', "hi"), ('normal', "hello"), ('normal', "u there?"), ('normal', "ok"), ('normal', "okkk"),
+    ('normal', "hmmm"), ('normal', "wyd"), ('normal', "hbu"), ('normal', "lol"), ('normal', "brb"),
+    ('normal', "gn"), ('normal', "gm"), ('normal', "kya kar rahe ho"), ('normal', "kal milte hai"),
+    ('normal', "bhai kaha hai tu"), ('normal', "achha theek hai"), ('normal', "haan"), ('normal', "nahi yaar"),
+    ('normal', "kemiti acha"), ('normal', "kana karuchu"), ('normal', "sab thik"), ('normal', "hahahaha"),
+    ('normal', "lmaooo"), ('normal', "what time tomorrow?"), ('normal', "call me when free"),
+    ('normal', "did you eat?"), ('normal', "send the notes pls"), ('normal', "where r u"),
+    ('normal', "omg really?"), ('normal', "thx"), ('normal', "ty"), ('normal', "np"), ('normal', "ikr"),
+    ('normal', "idk"), ('normal', "bruh"), ('normal', "ok 👍"), ('normal', "good night 😴"),
+    ('normal', "happy birthday!!"), ('normal', "meeting at 5"), ('normal', "Rahul is coming"),
+    ('normal', "Bhubaneswar jaiba?"), ('normal', "xD"), ('normal', "k"), ('normal', "hmm ok"),
+    ('normal', "congratssss"), ('normal', "whatsapp pe bhej"), ('normal', "sry"), ('normal', "tmrw"),
+    ('normal', "abhi"), ('normal', "chalo"), ('normal', "Priyanshu"), ('normal', "physics homework"),
+    ('normal', "screenshot bhej"), ('normal', "Cuttack"), ('normal', "strengths"), ('normal', "10 baje"),
+    ('normal', "https://youtu.be/dQw4w9WgXcQ"), ('normal', "??"), ('normal', "Maybemaybemaybe"),
+    ('normal', "kitna hua"), ('normal', "mummy bula rahi hai"), ('normal', "instagram pe dekh"),
+]
+
+# Held-out messages, never used to build the lexicon or pick thresholds; the
+# score here is the one to trust for production
+CLASSIFIER_HELDOUT = [
+    ('gibberish', "mxnbvcz"), ('gibberish', "poiuyt"), ('gibberish', "lkjhg fdsaq"), ('gibberish', "jfkdjfkdjf"),
+    ('gibberish', "qpwoeiruty"), ('gibberish', "sjdhfksjdhf"), ('gibberish', "zmxncbv"), ('gibberish', "hgfhgfhgf"),
+    ('gibberish', "ajsdkasjd"), ('gibberish', "dkfjgldkfjg"), ('gibberish', "wertwert"), ('gibberish', "xcbvxcb"),
+    ('gibberish', "nmbnmbnmb"), ('gibberish', "fhfhfhfhgjgj"), ('gibberish', "rtyrtyrty"), ('gibberish', "kdkdkdkslsl"),
+    ('gibberish', "vbvbvbvnvn"), ('gibberish', "jhgjhgjhg"), ('gibberish', "oweiruowieru"), ('gibberish', "lskdjflskdjf"),
+    ('gibberish', "ghghghfhfh"), ('gibberish', "pqowieur"), ('gibberish', "ksjdfhg"), ('gibberish', "mznxbcv"),
+    ('gibberish', "yuiyuiyui"), ('gibberish', "ddfdfdsfsd"), ('gibberish', "hgkjhgkjh"), ('gibberish', "cvbcvbcvb"),
+    ('gibberish', "fdsafdsa"), ('gibberish', "jjjkkklll"),
+    ('emoji', "🙂"), ('emoji', "😎😎"), ('emoji', "💀"), ('emoji', "🎉🎉🎉"), ('emoji', "🤔"), ('emoji', "😅"),
+    ('emoji', "👌🏼"), ('emoji', "🙌"), ('emoji', "💔"), ('emoji', "😴😴"),
+    ('normal', "gonna be late"), ('normal', "wanna grab food?"), ('normal', "lemme check"), ('normal', "omw"),
+    ('normal', "wyd rn"), ('normal', "ttys"), ('normal', "tbf"), ('normal', "idc"), ('normal', "ilysm"),
+    ('normal', "wdym"), ('normal', "hmu"), ('normal', "fomo"), ('normal', "yolo"), ('normal', "bestie"),
+    ('normal', "dude"), ('normal', "bro"), ('normal', "sis"), ('normal', "yess pls"), ('normal', "nooo"),
+    ('normal', "whyyy"), ('normal', "kidding"), ('normal', "same here"), ('normal', "sounds good"),
+    ('normal', "text me"), ('normal', "miss u"), ('normal', "shubh ratri"), ('normal', "kya scene hai"),
+    ('normal', "chai peene chal"), ('normal', "bohot badhiya"), ('normal', "mast"), ('normal', "bindaas"),
+    ('normal', "pakka"), ('normal', "khana khaya?"), ('normal', "so ja"), ('normal', "nind aa rahi"),
+    ('normal', "kidhar ho"), ('normal', "tension mat le"), ('normal', "arey yaar"), ('normal', "pagal hai kya"),
+    ('normal', "chup kar"), ('normal', "ekdum"), ('normal', "bilkul"), ('normal', "jaldi aa"),
+    ('normal', "exam kaisa gaya"), ('normal', "mu jauchi"), ('normal', "bhala lagila"), ('normal', "thnks"),
+    ('normal', "plss"), ('normal', "srry"), ('normal', "gdnight"), ('normal', "nite"), ('normal', "xoxo"),
+    ('normal', "awww"), ('normal', "ughhh"), ('normal', "meh"), ('normal', "yikes"), ('normal', "oof"),
+    ('normal', "brooo"), ('normal', "dmed u"), ('normal', "netflix tonight?"), ('normal', "Swastik"),
+    ('normal', "Sambalpur"), ('normal', "Puri chalo"), ('normal', "shkriya"), ('normal', "bkwas"),
+    ('normal', "mstt"), ('normal', "hwzit"), ('normal', "sched"), ('normal', "thnkuu"),
+    ('normal', "project"), ('normal', "project?"), ('normal', "submit project"), ('normal', "receipt bhej"),
+    ('normal', "subject"), ('normal', "symptom"), ('normal', "crypto"), ('normal', "nightclubs"),
+    ('normal', "rhythm"), ('normal', "strength"), ('normal', "twelfth"), ('normal', "schedule"),
+    ('normal', "algorithm"), ('normal', "chemistry assignment"), ('normal', "pharmacy"), ('normal', "psychology"),
+    ('normal', "lengths"), ('normal', "jackfruit"), ('normal', "script"), ('normal', "abstract"),
+    ('normal', "sculpt"), ('normal', "bankrupt"), ('normal', "technique"), ('normal', "aquarium"),
+    ('normal', "zigzag"), ('normal', "xylophone"), ('normal', "knapsack"), ('normal', "mnemonic"),
+    ('normal', "fjord"), ('normal', "tsunami"), ('normal', "Krishna"), ('normal', "Jagannath"),
+    ('normal', "WiFi password"), ('normal', "Zomato order"), ('normal', "Flipkart"), ('normal', "kubernetes"),
+    ('normal', "javascript"), ('normal', "python script"), ('normal', "dbms lab"), ('normal', "btech"),
+    ('normal', "pdf bhej"), ('normal', "xerox"), ('normal', "gym"), ('normal', "lynx"), ('normal', "pfft"),
+    ('normal', "shhh"), ('normal', "brr"), ('normal', "tsk tsk"), ('normal', "hmph"), ('normal', "grr"),
+    ('normal', "instagram reels"), ('normal', "playlist"), ('normal', "bachpan"), ('normal', "dhruv"),
+    ('normal', "khwaab"), ('normal', "sqrt"), ('normal', "matplotlib"), ('normal', "ctrl c"),
+]
+
+class MessageClassifier:
+    """Microsecond triage of messages the model shouldn't be paid to read.
+
+    'emoji' for emoji-only messages; 'gibberish' for keyboard mashes, judged
+    by the share of known words, the bits per character of unknown words
+    under a character bigram model of the lexicon, long consonant runs and
+    keyboard-row walks; None for everything else.
+    """
+
+    ALPHABET = "^abcdefghijklmnopqrstuvwxyz$"
+    KEYBOARD_ROWS = ("qwertyuiop", "asdfghjkl", "zxcvbnm")
+    LONG_WALK = 7
+    VOWELS = set("aeiouy")
+
+    def __init__(self, lexicon=CLASSIFIER_LEXICON, max_bits=5.2, min_known=0.5, min_random_length=6,
+                 max_consonant_run=7):
+        self.lexicon = lexicon
+        self.max_bits = max_bits
+        self.min_known = min_known
+        # Texting shorthand drops vowels ("smthng", "dhnyvd"), so short or vowel-less words alone prove nothing
+        self.min_random_length = min_random_length
+        self.max_consonant_run = max_consonant_run
+        counts = {}
+        for word in lexicon:
+            padded = f"^{word}$"
+            for a, b in zip(padded, padded[1:]):
+                counts[(a, b)] = counts.get((a, b), 0) + 1
+        totals = {}
+        for (a, _), n in counts.items():
+            totals[a] = totals.get(a, 0) + n
+        size = len(self.ALPHABET)
+        # Add-half smoothing so unseen pairs cost a lot but not infinity
+        self.bits = {(a, b): -math.log2((counts.get((a, b), 0) + 0.5) / (totals.get(a, 0) + 0.5 * size))
+                     for a in self.ALPHABET for b in self.ALPHABET}
+
+    @staticmethod
+    def is_emoji_only(text):
+        """True when `text` has emoji and nothing but emoji, modifiers, spaces and punctuation"""
+        has_emoji = False
+        for char in text:
+            category = unicodedata.category(char)
+            if category == 'So':
+                has_emoji = True
+            elif char.isalnum():
+                return False
+        return has_emoji
+
+    def token_bits(self, token):
+        """Average bits per transition of `token` under the lexicon's bigram model"""
+        padded = f"^{token}$"
+        pairs = list(zip(padded, padded[1:]))
+        return sum(self.bits[pair] for pair in pairs) / len(pairs)
+
+    def looks_random(self, token):
+        """At least two of: a keyboard-row walk, a long consonant run, improbable letter pairs.
+
+        Any one signal alone also fires on real words (rare consonant
+        clusters, names, loanwords), and a wrong "???" is worse than
+        letting a mash through to the model. The exception is a walk of
+        LONG_WALK or more keys straight along one row, which no word is.
+        """
+        if len(token) < self.min_random_length:
+            return False
+        walk = any(token in row or token[::-1] in row for row in self.KEYBOARD_ROWS)
+        if walk and len(token) >= self.LONG_WALK:
+            return True
+        run = longest = 0
+        for char in token:
+            run = 0 if char in self.VOWELS else run + 1
+            longest = max(longest, run)
+        signals = [
+            walk,
+            longest >= self.max_consonant_run,
+            self.token_bits(token) > self.max_bits,
+        ]
+        return sum(signals) >= 2
+
+    def classify(self, text):
+        """'emoji', 'gibberish' or None"""
+        text = (text or "").strip()
+        if not text:
+            return None
+        if self.is_emoji_only(text):
+            return 'emoji'
+        if re.search(r"https?://|\d", text):
+            return None
+        tokens = [re.sub(r"(.)\1{2,}", r"\1", token) for token in re.findall(r"[a-z]+", text.lower())]
+        if not tokens:
+            return None
+        known = sum(1 for token in tokens if token in self.lexicon or re.fullmatch(r"(h[aeiou]|[aeiou]h|lo|ja)+h?", token))
+        if known / len(tokens) >= self.min_known:
+            return None
+        # Gibberish when random-looking unknown words make up most of the letters
+        random_letters = sum(len(token) for token in tokens if token not in self.lexicon and self.looks_random(token))
+        if random_letters / sum(len(token) for token in tokens) > 0.5:
+            return 'gibberish'
+        return None
+
+    def evaluate(self, corpus=CLASSIFIER_CORPUS):
+        """Precision/recall per label over `corpus`, the misclassified messages and microseconds per call"""
+        predictions = []
+        started = time.perf_counter()
+        for _, text in corpus:
+            predictions.append(self.classify(text) or 'normal')
+        per_call_us = (time.perf_counter() - started) / len(corpus) * 1e6
+        report = {}
+        for label in ('gibberish', 'emoji'):
+            tp = sum(1 for (truth, _), guess in zip(corpus, predictions) if truth == label and guess == label)
+            fp = sum(1 for (truth, _), guess in zip(corpus, predictions) if truth != label and guess == label)
+            fn = sum(1 for (truth, _), guess in zip(corpus, predictions) if truth == label and guess != label)
+            report[label] = {'precision': tp / (tp + fp) if tp + fp else 1.0,
+                             'recall': tp / (tp + fn) if tp + fn else 1.0,
+                             'support': tp + fn}
+        errors = [(truth, guess, text) for (truth, text), guess in zip(corpus, predictions) if truth != guess]
+        return report, errors, per_call_us
+
+class BurstCoalescer:
+    """Per-chat debounce that turns a burst of consecutive messages into one.
+
+    Every message pushes its chat's deadline `quiet_seconds` further out, but
+    never past `max_wait_seconds` after the first one. A chat whose contact
+    is still typing is held until that cap. Due bursts come out merged, so
+    the whole burst gets one model call and one approval dialog.
+    """
+
+    def __init__(self, quiet_seconds=2.5, max_wait_seconds=8, poll_seconds=0.5):
+        self.quiet_seconds = quiet_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.poll_seconds = poll_seconds  # how often a held (typing) chat is re-checked
+        self.bursts = {}  # chat -> {'messages', 'first', 'last'}
+        self.stats = {'messages': 0, 'bursts': 0}
+
+    def add(self, message):
+        """Hold a message in its chat's burst; returns the burst size, or 0 if it is already held"""
+        now = time.monotonic()
+        burst = self.bursts.setdefault(message.get('chat'), {'messages': [], 'first': now})
+        if any(held['hash'] == message['hash'] for held in burst['messages']):
+            return 0
+        burst['messages'].append(message)
+        burst['last'] = now
+        self.stats['messages'] += 1
+        return len(burst['messages'])
+
+    def deadline(self, burst, typing=False):
+        cap = burst['first'] + self.max_wait_seconds
+        return cap if typing else min(burst['last'] + self.quiet_seconds, cap)
+
+    def quiet(self):
+        """Chats whose sender has paused long enough (typing not yet considered)"""
+        now = time.monotonic()
+        return [chat for chat, burst in self.bursts.items() if now >= self.deadline(burst)]
+
+    def next_wait(self, default):
+        """Seconds the intake may block before a burst needs looking at"""
+        if not self.bursts:
+            return default
+        remaining = min(self.deadline(burst) for burst in self.bursts.values()) - time.monotonic()
+        return min(default, remaining if remaining > 0 else self.poll_seconds)
+
+    def due(self, typing=()):
+        """Pop every burst that is ready, each merged into a single message"""
+        now = time.monotonic()
+        ready = []
+        for chat, burst in list(self.bursts.items()):
+            if now >= self.deadline(burst, chat in typing):
+                del self.bursts[chat]
+                self.stats['bursts'] += 1
+                ready.append(self.merge(burst['messages']))
+        return ready
+
+    @staticmethod
+    def merge(messages):
+        """One message carrying the whole burst: texts on separate lines, every part's hash kept for dedupe"""
+        if len(messages) == 1:
+            return messages[0]
+        merged = dict(messages[-1])
+        merged['text'] = "\n".join(message['text'] for message in messages)
+        merged['hashes'] = [key for message in messages for key in message.get('hashes') or [message['hash']]]
+        merged['parts'] = sum(message.get('parts', 1) for message in messages)
+        merged['media'] = any(message.get('media') for message in messages)
+        return merged
+
+class ReplyCache:
+    """Sent replies to short recurring messages ("hi", "u there?"), keyed by normalized text and persona.
+
+    LRU with a TTL. Several variants are kept per key and served in random
+    order, and only once a key has `min_variants` of them, so cached replies
+    don't read as canned.
+    """
+
+    def __init__(self, max_entries=500, ttl_seconds=86400, max_variants=5, min_variants=2):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_variants = max_variants
+        self.min_variants = min_variants
+        self.entries = OrderedDict()  # key -> (stored_at, [variants])
+        self.lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'calls_avoided': 0}
+
+    @staticmethod
+    def normalize(text):
+        """Case, punctuation, spacing and stretched letters ("hiiii") folded away"""
+        text = re.sub(r"(.)\1{2,}", r"\1\1", text.lower())
+        text = re.sub(r"[.,!?;:'\"~*_()\-]+", " ", text)
+        return " ".join(text.split())
+
+    @staticmethod
+    def key_for(text, persona):
+        """Cache key for `text` under the given custom_prompt"""
+        persona_hash = hashlib.blake2b(persona.encode('utf-8'), digest_size=6).hexdigest()
+        return f"{persona_hash}|{ReplyCache.normalize(text)}"
+
+    def get(self, key):
+        """Cached variants for `key` in random order, or None on a miss"""
+        with self.lock:
+            self.stats['lookups'] += 1
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, variants = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self.entries[key]
+                return None
+            if len(variants) < self.min_variants:
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return random.sample(variants, len(variants))
+
+    def add(self, key, reply):
+        """Remember a reply that was actually sent for `key`"""
+        with self.lock:
+            _, variants = self.entries.pop(key, (None, []))
+            if reply not in variants:
+                variants = (variants + [reply])[-self.max_variants:]
+            self.entries[key] = (time.time(), variants)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        """Fraction of lookups answered from the cache"""
+        return self.stats['hits'] / self.stats['lookups'] if self.stats['lookups'] else 0.0
+
+class PaneCapture:
+    """Turns conversation-pane screenshots into small images for the model.
+
+    Images are downscaled and re-encoded until they fit `max_bytes`, and a
+    256-bit difference hash per chat lets us skip the image entirely when the
+    pane looks the same as the last one we sent.
+    """
+
+    def __init__(self, max_bytes=150000, max_side=1024, image_format="JPEG", change_threshold=4):
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.image_format = image_format.upper()
+        self.change_threshold = change_threshold
+        self.last_hashes = {}
+        self.lock = threading.Lock()
+        self.stats = {'sent': 0, 'skipped': 0, 'bytes_raw': 0, 'bytes_sent': 0}
+
+    @staticmethod
+    def dhash(img, size=16):
+        """Difference hash: one bit per horizontally adjacent pixel pair of a (size+1) x size thumbnail"""
+        small = img.convert('L').resize((size + 1, size), Image.Resampling.LANCZOS)
+        pixels = list(small.getdata())
+        bits = 0
+        for row in range(size):
+            for col in range(size):
+                bits = (bits << 1) | (pixels[row * (size + 1) + col] > pixels[row * (size + 1) + col + 1])
+        return bits
+
+    def encode(self, img):
+        """Downscale and compress until the image fits the byte budget"""
+        img = img.convert('RGB')
+        img.thumbnail((self.max_side, self.max_side), Image.Resampling.LANCZOS)
+        while True:
+            for quality in (80, 65, 50, 35):
+                buffer = io.BytesIO()
+                img.save(buffer, format=self.image_format, quality=quality)
+                if buffer.tell() <= self.max_bytes:
+                    return buffer.getvalue()
+            if max(img.size) <= 320:
+                return buffer.getvalue()
+            img = img.resize((int(img.width * 0.75), int(img.height * 0.75)), Image.Resampling.LANCZOS)
+
+    def prepare(self, png_bytes, chat=None):
+        """Content part for the model, or None when the pane hasn't meaningfully changed"""
+        with Image.open(io.BytesIO(png_bytes)) as img:
+            img.load()
+            fingerprint = self.dhash(img)
+            with self.lock:
+                previous = self.last_hashes.get(chat)
+                if previous is not None and bin(previous ^ fingerprint).count('1') <= self.change_threshold:
+                    self.stats['skipped'] += 1
+                    return None
+                self.last_hashes[chat] = fingerprint
+            data = self.encode(img)
+
+        with self.lock:
+            self.stats['sent'] += 1
+            self.stats['bytes_raw'] += len(png_bytes)
+            self.stats['bytes_sent'] += len(data)
+        return {'mime_type': f"image/{self.image_format.lower()}", 'data': data}
+
+class DriverResolver:
+    """Local ChromeDriver/Chrome version checks, so a pinned driver is reused without a network lookup"""
+
+    LINUX_BINARIES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")
+    MAC_BINARY = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+
+    @staticmethod
+    def major(version_text):
+        """Leading major version in e.g. 'Google Chrome 120.0.6099.109', or None"""
+        match = re.search(r"(\d+)\.\d+\.\d+", version_text or "")
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def run_version(binary):
+        """`binary --version` output, or '' if it cannot be run"""
+        try:
+            result = subprocess.run([binary, "--version"], capture_output=True, text=True, timeout=10)
+            return result.stdout.strip()
+        except Exception:
+            return ""
+
+    @staticmethod
+    def chrome_major(binary=None):
+        """Installed Chrome major version, read locally; None if it cannot be determined"""
+        if binary:
+            return DriverResolver.major(DriverResolver.run_version(binary))
+        if sys.platform.startswith("win"):
+            # chrome.exe --version opens a window on Windows; the updater records the version here
+            try:
+                import winreg
+                with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Google\Chrome\BLBeacon") as key:
+                    return DriverResolver.major(winreg.QueryValueEx(key, "version")[0])
+            except Exception:
+                return None
+        candidates = [DriverResolver.MAC_BINARY] if sys.platform == "darwin" else \
+            [path for path in map(shutil.which, DriverResolver.LINUX_BINARIES) if path]
+        for candidate in candidates:
+            found = DriverResolver.major(DriverResolver.run_version(candidate))
+            if found:
+                return found
+        return None
+
+    @staticmethod
+    def driver_major(path):
+        """Major version of the chromedriver at `path`, or None"""
+        return DriverResolver.major(DriverResolver.run_version(path))
+
+class DedupeStore:
+    """Keys of messages we already replied to, kept in SQLite.
+
+    Membership checks hit an in-memory set loaded once at startup, and each
+    new key is a single INSERT. Entries older than `ttl_days` or beyond
+    `max_entries` are evicted, so the file, the startup load and the
+    per-message write all stay flat however long the bot runs.
+    """
+
+    EVICT_EVERY = 500
+
+    def __init__(self, path="repliq_dedupe.db", ttl_days=30, max_entries=50000):
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS replied (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS replied_seen_at ON replied (seen_at)")
+        self.evict()
+        self.keys = {row[0] for row in self.conn.execute("SELECT key FROM replied")}
+        self.adds_since_evict = 0
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        """Remember `key`; returns False if it was already known"""
+        with self.lock:
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO replied (key, seen_at) VALUES (?, ?)", (key, time.time()))
+            self.adds_since_evict += 1
+            if self.adds_since_evict >= self.EVICT_EVERY:
+                self.evict()
+            return True
+
+    def migrate(self, keys):
+        """Import keys from the old replied_messages list in bot_config.json"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO replied (key, seen_at) VALUES (?, ?)",
+                                  [(key, now) for key in keys])
+            self.keys.update(keys)
+
+    def evict(self):
+        """Drop expired entries, then the oldest ones beyond max_entries"""
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM replied WHERE seen_at < ?", (time.time() - self.ttl,))
+            removed = cursor.rowcount
+            cursor = self.conn.execute(
+                "DELETE FROM replied WHERE key IN (SELECT key FROM replied ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            removed += cursor.rowcount
+        if removed and hasattr(self, 'keys'):
+            self.keys = {row[0] for row in self.conn.execute("SELECT key FROM replied")}
+        self.adds_since_evict = 0
+        return removed
+
+GEMINI_MODEL_CANDIDATES = [
+    'gemini-1.5-flash-latest',
+    'gemini-1.5-flash',
+    'gemini-pro',
+    'gemini-1.5-pro-latest'
+]
+
+def google_api_errors(*names):
+    """google.api_core exception classes by name; empty when the Gemini SDK is not installed"""
+    try:
+        module = importlib.import_module("google.api_core.exceptions")
+    except ImportError:
+        return ()
+    return tuple(getattr(module, name) for name in names if hasattr(module, name))
+
+class BackendResponse:
+    """Minimal stand-in for a Gemini response: just the `.text` the bot reads"""
+
+    def __init__(self, text):
+        self.text = text
+
+class GeminiBackend:
+    """google.generativeai model behind the common `generate_content` / `stream_content` interface.
+
+    With `rediscover`, the model is trusted without a startup probe: if its
+    first real request is refused because of the model itself (unknown or
+    not allowed), `rediscover(exclude=name)` finds a working model and the
+    request is retried once on it. Transient errors (quota, timeouts, 5xx)
+    are raised as-is so the caller's retry and rate limiting handle them.
+    """
+
+    def __init__(self, model, model_name, rediscover=None):
+        self.model = model
+        self.model_name = model_name
+        self.name = f"gemini:{model_name}"
+        self.rediscover = rediscover
+        self.validated = rediscover is None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def model_unavailable(error):
+        """Did the API refuse the model itself, rather than this one request?"""
+        if isinstance(error, google_api_errors("NotFound")):
+            return True
+        return isinstance(error, google_api_errors("InvalidArgument", "PermissionDenied")) \
+            and "model" in str(error).lower()
+
+    def call(self, request):
+        """Run `request(model)`; an unvalidated model the API refuses is swapped for a working one and retried once"""
+        model = self.model
+        try:
+            result = request(model)
+        except Exception as e:
+            if self.validated or not self.model_unavailable(e):
+                raise
+            with self.lock:
+                if not self.validated and self.model is model:
+                    try:
+                        self.model, self.model_name = self.rediscover(exclude=self.model_name)
+                        self.name = f"gemini:{self.model_name}"
+                    finally:
+                        self.validated = True  # one rediscovery per run, even if it found nothing
+            return request(self.model)
+        self.validated = True
+        return result
+
+    @staticmethod
+    def request_options(timeout):
+        return {'request_options': {'timeout': timeout}} if timeout else {}
+
+    def generate_content(self, parts, generation_config=None, timeout=None):
+        return self.call(lambda model: model.generate_content(parts, generation_config=generation_config,
+                                                              **self.request_options(timeout)))
+
+    def count_tokens(self, parts):
+        """Exact prompt size from the API (one extra round trip)"""
+        return self.model.count_tokens(parts).total_tokens
+
+    def stream_content(self, parts, generation_config=None, timeout=None):
+        """Yield reply text as Gemini produces it; closing the generator abandons the rest"""
+        def start(model):
+            chunks = iter(model.generate_content(parts, generation_config=generation_config, stream=True,
+                                                 **self.request_options(timeout)))
+            return chunks, next(chunks, None)  # the first chunk is what proves the model works
+
+        chunks, first = self.call(start)
+        while first is not None:
+            try:
+                text = first.text
+            except ValueError:  # chunk without text parts (e.g. only a finish reason)
+                text = ""
+            if text:
+                yield text
+            first = next(chunks, None)
+
+class OpenAICompatibleBackend:
+    """Any /v1/chat/completions endpoint: a local server, a proxy, or the bundled mock"""
+
+    def __init__(self, base_url, model, api_key="", timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.name = f"openai:{model}@{self.base_url}"
+
+    def build_payload(self, parts, generation_config=None):
+        """Translate Gemini-style content parts into a chat-completions request"""
+        content = []
+        for part in parts if isinstance(parts, list) else [parts]:
+            if isinstance(part, str):
+                content.append({'type': 'text', 'text': part})
+            else:
+                encoded = base64.b64encode(part['data']).decode('ascii')
+                content.append({'type': 'image_url',
+                                'image_url': {'url': f"data:{part['mime_type']};base64,{encoded}"}})
+        config = generation_config or {}
+        payload = {'model': self.model, 'messages': [{'role': 'user', 'content': content}]}
+        for ours, theirs in (('temperature', 'temperature'), ('top_p', 'top_p'), ('max_output_tokens', 'max_tokens')):
+            if ours in config:
+                payload[theirs] = config[ours]
+        return payload
+
+    def post(self, payload, timeout=None):
+        """POST a payload to the chat-completions endpoint and return the raw response"""
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(f"{self.base_url}/chat/completions",
+                                         data=json.dumps(payload).encode('utf-8'), headers=headers)
+        return urllib.request.urlopen(request, timeout=timeout or self.timeout)
+
+    def generate_content(self, parts, generation_config=None, timeout=None):
+        with self.post(self.build_payload(parts, generation_config), timeout) as response:
+            body = json.loads(response.read().decode('utf-8'))
+        return BackendResponse(body['choices'][0]['message']['content'] or "")
+
+    def stream_content(self, parts, generation_config=None, timeout=None):
+        """Yield reply text from the server-sent event stream; closing the generator drops the connection"""
+        payload = self.build_payload(parts, generation_config)
+        payload['stream'] = True
+        with self.post(payload, timeout) as response:
+            for raw in response:
+                line = raw.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                choices = json.loads(data).get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    yield text
+
+class ModelHealth:
+    """Rolling latency and error window for one model"""
+
+    def __init__(self, window=50):
+        self.samples = deque(maxlen=window)  # seconds per successful call, None per failure
+        self.last_sample = 0.0
+
+    def record(self, seconds, ok):
+        self.samples.append(seconds if ok else None)
+        self.last_sample = time.monotonic()
+
+    def error_rate(self):
+        return sum(1 for sample in self.samples if sample is None) / len(self.samples) if self.samples else 0.0
+
+    def percentile(self, q):
+        """Latency percentile in ms over recent successes, or None without data"""
+        latencies = sorted(sample for sample in self.samples if sample is not None)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+class ModelRouter:
+    """Picks a model per request from a fast and a strong tier.
+
+    Requests go to the fast tier unless their features call for escalation.
+    Within a tier the configured order holds, except that models over the
+    error budget (degraded) or over the p95 latency SLO sink to the end, so
+    traffic fails over on its own. A degraded model gets another chance once
+    it has been left alone for `recovery_seconds`.
+    """
+
+    def __init__(self, fast, strong, make_backend, slo_ms=3000, max_error_rate=0.5, recovery_seconds=60):
+        self.tiers = {'fast': list(fast), 'strong': [name for name in strong if name not in fast]}
+        self.make_backend = make_backend
+        self.slo_ms = slo_ms
+        self.max_error_rate = max_error_rate
+        self.recovery_seconds = recovery_seconds
+        self.backends = {}
+        self.health = {name: ModelHealth() for name in self.tiers['fast'] + self.tiers['strong']}
+        self.lock = threading.Lock()
+
+    def backend(self, name):
+        """Backend for `name`, created on first use"""
+        with self.lock:
+            if name not in self.backends:
+                self.backends[name] = self.make_backend(name)
+            return self.backends[name]
+
+    def degraded(self, name):
+        health = self.health[name]
+        if len(health.samples) < 3 or health.error_rate() <= self.max_error_rate:
+            return False
+        if time.monotonic() - health.last_sample > self.recovery_seconds:
+            health.samples.clear()  # long enough on the bench: probe it again
+            return False
+        return True
+
+    def over_slo(self, name):
+        p95 = self.health[name].percentile(0.95)
+        return p95 is not None and p95 > self.slo_ms
+
+    def ranked(self, tier):
+        """Model names to try for `tier`, best first, with the other tier as the fallback"""
+        other = 'strong' if tier == 'fast' else 'fast'
+        names = self.tiers[tier] + self.tiers[other]
+        return sorted(names, key=lambda name: (self.degraded(name), self.over_slo(name), names.index(name)))
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.health[name].record(seconds, ok)
+
+    def report(self):
+        """One line per model: tier, p50/p95 and error rate"""
+        lines = []
+        for tier, names in self.tiers.items():
+            for name in names:
+                health = self.health[name]
+                if not health.samples:
+                    continue
+                p50, p95 = health.percentile(0.50), health.percentile(0.95)
+                latency = f"p50 {p50:.0f}ms p95 {p95:.0f}ms" if p50 is not None else "no successes"
+                lines.append(f"{name} ({tier}): {len(health.samples)} calls, {latency}, "
+                             f"{health.error_rate():.0%} errors{' [degraded]' if self.degraded(name) else ''}")
+        return lines
+
+class MockLLMServer:
+    """Local OpenAI-compatible stub with configurable latency and canned replies.
+
+    Lets the reply path be benchmarked and regression-tested without API
+    quota or network: point `llm_base_url` at it and use `llm_backend: openai`.
+    """
+
+    DEFAULT_REPLIES = ["Hmm", "Okk", "Yeah sure", "Hn mujhe pata hai", "Wby?", "Ofc"]
+
+    def __init__(self, host="127.0.0.1", port=8765, latency_ms=400, jitter_ms=150, replies=None, token_ms=40):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_ms = token_ms  # gap between streamed tokens; latency_ms is the time to the first one
+        self.replies = replies or self.DEFAULT_REPLIES
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'):
+                    self.send_json({'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                server.requests += 1
+                time.sleep(server.delay())
+                reply = random.choice(server.replies)
+                if request.get('stream'):
+                    self.send_stream(request.get('model', 'mock'), reply)
+                    return
+                self.send_json({
+                    'id': f"mock-{server.requests}",
+                    'object': 'chat.completion',
+                    'model': request.get('model', 'mock'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': reply}}],
+                })
+
+            def send_stream(self, model, reply):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                try:
+                    for token in re.findall(r'\S+\s*', reply):
+                        chunk = {'object': 'chat.completion.chunk', 'model': model,
+                                 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                        time.sleep(server.token_ms / 1000)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client cancelled the stream
+
+            def send_json(self, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/v1"
+
+    def delay(self):
+        """Seconds to wait before answering one request"""
+        return max(0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def start(self):
+        """Serve on a background thread; returns self"""
+        threading.Thread(target=self.httpd.serve_forever, name="repliq-mock-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class PromptBudget:
+    """Keeps reply prompts under a per-request token budget.
+
+    Tokens are estimated locally (about four ASCII characters per token, one
+    per emoji or non-Latin character, a flat rate per image). Conversation
+    context is dropped oldest-first until the text fits, and usage is totalled
+    for the session stats.
+    """
+
+    def __init__(self, budget=1200, line_tokens=60, message_tokens=300, style_tokens=600, image_tokens=258):
+        self.budget = budget
+        self.line_tokens = line_tokens
+        self.message_tokens = message_tokens
+        self.style_tokens = style_tokens
+        self.image_tokens = image_tokens
+        self.lock = threading.Lock()
+        self.stats = {'prompts': 0, 'text_tokens': 0, 'image_tokens': 0, 'trimmed': 0, 'lines_dropped': 0}
+
+    @staticmethod
+    def estimate(text):
+        """Approximate token count of `text`"""
+        ascii_chars = sum(1 for char in text if ord(char) < 128)
+        return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+    @staticmethod
+    def clip(text, max_tokens):
+        """`text` cut to roughly `max_tokens`, marked with an ellipsis when cut"""
+        if PromptBudget.estimate(text) <= max_tokens:
+            return text
+        keep = len(text)
+        while keep and PromptBudget.estimate(text[:keep]) > max_tokens - 1:
+            keep = int(keep * 0.9)
+        return text[:keep].rstrip() + "…"
+
+    def fit(self, render, context_lines):
+        """`render(context_text)` with as many of the newest context lines as fit; returns (prompt, kept, dropped)"""
+        lines = [self.clip(line, self.line_tokens) for line in context_lines]
+
+        def newest(reserve):
+            available = self.budget - self.estimate(render("")) - reserve
+            kept = []
+            for line in reversed(lines):
+                cost = self.estimate(line) + 1
+                if cost > available:
+                    break
+                kept.insert(0, line)
+                available -= cost
+            return kept
+
+        def context(kept):
+            dropped = len(lines) - len(kept)
+            text = "\n".join(kept)
+            return f"(… {dropped} earlier messages not shown)\n{text}".strip() if dropped else text
+
+        kept = newest(0)
+        if len(kept) < len(lines):
+            # Dropping lines adds the marker, so its cost has to fit as well
+            kept = newest(self.estimate(context([])) + 1)
+        while kept and self.estimate(render(context(kept))) > self.budget:
+            kept.pop(0)  # per-line estimates round up separately; settle on the real total
+        return render(context(kept)), len(kept), len(lines) - len(kept)
+
+    def record(self, text_tokens, image_count, dropped):
+        """Add one prompt to the session totals; returns its image token estimate"""
+        image_tokens = image_count * self.image_tokens
+        with self.lock:
+            self.stats['prompts'] += 1
+            self.stats['text_tokens'] += text_tokens
+            self.stats['image_tokens'] += image_tokens
+            self.stats['trimmed'] += 1 if dropped else 0
+            self.stats['lines_dropped'] += dropped
+        return image_tokens
+
+class TokenBucket:
+    """Refills continuously at `per_minute`, holds at most one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` is available (0 if it is now)"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+class RequestScheduler:
+    """Client-side RPM/TPM limiter in front of the model, serving waiting requests by priority.
+
+    Each call `acquire`s one request and its estimated tokens from two token
+    buckets; while they are empty, callers queue and the most urgent one
+    (lowest priority tuple) goes next. `throttle` pauses everyone after a 429.
+    A limit of 0 turns that bucket off.
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.buckets = [(bucket, kind) for bucket, kind in
+                        ((TokenBucket(rpm) if rpm else None, 'requests'), (TokenBucket(tpm) if tpm else None, 'tokens'))
+                        if bucket]
+        self.condition = threading.Condition()
+        self.waiting = []  # heap of (priority, seq)
+        self.seq = itertools.count()
+        self.paused_until = 0.0
+        self.stats = {'granted': 0, 'delayed': 0, 'wait_seconds': 0.0, 'throttled': 0}
+
+    def acquire(self, tokens, priority=(1, 0)):
+        """Block until this request fits both budgets and nothing more urgent is waiting; returns seconds waited"""
+        if not self.buckets and not self.paused_until:
+            self.stats['granted'] += 1
+            return 0.0
+        started = time.monotonic()
+        entry = (priority, next(self.seq))
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            while True:
+                now = time.monotonic()
+                delay = None  # not at the head: wait to be woken
+                if self.waiting[0] == entry:
+                    amounts = {'requests': 1, 'tokens': tokens}
+                    delay = max([self.paused_until - now] + [bucket.wait_time(amounts[kind], now)
+                                                             for bucket, kind in self.buckets])
+                    if delay <= 0:
+                        heapq.heappop(self.waiting)
+                        for bucket, kind in self.buckets:
+                            bucket.take(amounts[kind])
+                        self.condition.notify_all()
+                        break
+                self.condition.wait(timeout=delay)
+        waited = time.monotonic() - started
+        self.stats['granted'] += 1
+        if waited > 0.05:
+            self.stats['delayed'] += 1
+            self.stats['wait_seconds'] += waited
+        return waited
+
+    def throttle(self, seconds):
+        """Hold every request for `seconds` (the API said we are over quota)"""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.stats['throttled'] += 1
+            self.condition.notify_all()
+
+class CircuitOpenError(Exception):
+    """The model API is considered down; callers should answer locally"""
+
+class ReplyCancelled(Exception):
+    """The reply was cancelled (edited or superseded) before its request went out"""
+
+class CircuitBreaker:
+    """Stops calling a failing API for a while, then lets a single probe through.
+
+    closed -> open after `failure_threshold` consecutive failures; open ->
+    half_open once `reset_seconds` have passed, allowing one trial call; its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.on_change = on_change
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        self.stats = {'opened': 0, 'half_opened': 0, 'closed': 0, 'short_circuited': 0}
+
+    def allow(self):
+        """May a call go out now?"""
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._set('half_open')
+            if self.state == 'closed' or (self.state == 'half_open' and not self.probing):
+                self.probing = self.state == 'half_open'
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def is_open(self):
+        """True while calls would be refused without even trying"""
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_seconds
+
+    def release(self):
+        """Give back a half-open probe slot that was taken but never used for a call"""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != 'closed':
+                self._set('closed')
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set('open')
+
+    def _set(self, state):
+        self.state = state
+        self.stats[{'open': 'opened', 'half_open': 'half_opened', 'closed': 'closed'}[state]] += 1
+        if self.on_change:
+            self.on_change(state, self.failures)
+
+class PriorityJobQueue(queue.PriorityQueue):
+    """Bounded pipeline queue that hands out the most urgent job first (see `job['priority']`)"""
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.seq = itertools.count()
+
+    def _put(self, job):
+        super()._put((job.get('priority', (1, 0)), next(self.seq), job))
+
+    def _get(self):
+        return super()._get()[2]
+
+class ReplyStream:
+    """A reply still being generated on a worker thread, read by the approval dialog as it grows"""
+
+    def __init__(self, slot=0):
+        self.slot = slot  # candidate position in the approval dialog (0 = primary)
+        self.text = ""  # raw text received so far
+        self.final = None  # cleaned reply, set once generation ends
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.started = time.perf_counter()
+        self.first_token_ms = None
+
+    def push(self, chunk):
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self.started) * 1000
+        self.text += chunk
+
+    def finish(self, reply):
+        self.final = reply
+        self.done.set()
+
+    def cancel(self):
+        """Stop generating; whoever is reading the stream has what they need"""
+        self.cancelled.set()
+
+    def current(self):
+        """Best text to show right now"""
+        return self.final if self.final is not None else self.text
+
+class ReplyPipeline:
+    """Staged reply engine: detect -> context -> generate -> approve -> send.
+
+    Bounded queues sit between the stages, so a slow stage (usually the
+    operator) pushes back on the ones before it instead of letting work pile
+    up. Approval runs on the calling thread because Tk dialogs must.
+    """
+
+    def __init__(self, bot, queue_size=8, generation_workers=2):
+        self.bot = bot
+        self.context_queue = PriorityJobQueue(maxsize=queue_size)
+        self.generate_queue = PriorityJobQueue(maxsize=queue_size)
+        self.approve_queue = queue.Queue(maxsize=queue_size)
+        self.send_queue = queue.Queue(maxsize=queue_size)
+        self.generation_workers = generation_workers
+        self.running = False
+        self.threads = []
+
+    def start(self, detect):
+        """Start detection (the given monitor loop) and the background stages"""
+        self.running = True
+        self._spawn("detect", self._detect, detect)
+        self._spawn("context", self._stage, self.context_queue, self._gather_context)
+        for i in range(self.generation_workers):
+            self._spawn(f"generate-{i + 1}", self._stage, self.generate_queue, self._generate)
+        self._spawn("send", self._stage, self.send_queue, self._send)
+
+    def stop(self):
+        """Ask every stage to wind down"""
+        self.running = False
+        self.bot.monitoring = False
+
+    def busy(self):
+        """True while any job is queued or being worked on, i.e. a stage may want the driver soon"""
+        return any(stage_queue.unfinished_tasks for stage_queue in
+                   (self.context_queue, self.generate_queue, self.approve_queue, self.send_queue))
+
+    def submit(self, job):
+        """Hand a detected message to the pipeline; blocks while it is full"""
+        return self._put(self.context_queue, job)
+
+    def _spawn(self, name, target, *args):
+        thread = threading.Thread(target=target, args=args, name=f"repliq-{name}", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _put(self, stage_queue, job):
+        while self.running:
+            try:
+                stage_queue.put(job, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _detect(self, detect):
+        try:
+            detect()
+        finally:
+            self.running = False
+
+    def _stage(self, inbox, work):
+        while self.running:
+            try:
+                job = inbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                work(job)
+            except Exception as e:
+                self.bot.log(f" ⚠️ Pipeline stage error: {e}", Colors.RED)
+                traceback.print_exc()
+            finally:
+                inbox.task_done()
+
+    def _outdated(self, job):
+        """True (and logged) once a newer message has taken this job's place, or a refreshed dialog already answered it"""
+        if job.get('superseded'):
+            reason = "a newer message replaced it"
+        elif job.get('finished'):
+            reason = "already answered in a refreshed dialog"
+        else:
+            return False
+        self.bot.log(f" [⏭️ Dropping reply #{job.get('seq')} for {job.get('chat') or 'this chat'} - {reason}]",
+                     Colors.BLACK)
+        return True
+
+    def _gather_context(self, job):
+        if self._outdated(job):
+            return
+        job['cache_key'] = self.bot.reply_cache_key(job['text'], job.get('chat'))
+        cached = self.bot.instant_candidates(job['text'], job['cache_key'])
+        if cached:
+            # Gibberish, emoji or a recurring opener: no context scrape, no screenshot, no model call
+            job['candidates'] = cached
+            job['suggested'] = cached[0].current()
+            self._put(self.approve_queue, job)
+            return
+        job['reply_context'] = self.bot.gather_reply_context(job.get('chat'), job.get('media', False))
+        if not self._outdated(job):
+            self._put(self.generate_queue, job)
+
+    def _generate(self, job):
+        job['candidates'] = self.bot.new_candidates()
+        job['suggested'] = ""
+        if self._outdated(job):
+            return  # checked after the candidates exist, so a supersede or finish either sees them or is seen here
+        if self.bot.config.get("stream_replies", True):
+            # Hand the job to approval first, so the dialog opens and fills in as tokens arrive
+            if self._put(self.approve_queue, job):
+                self.bot.generate_candidates(job['text'], job['reply_context'], job['candidates'],
+                                             priority=job.get('priority'))
+            return
+        self.bot.generate_candidates(job['text'], job['reply_context'], job['candidates'], streaming=False,
+                                     priority=job.get('priority'))
+        job['suggested'] = job['candidates'][0].current()
+        self._put(self.approve_queue, job)
+
+    def _send(self, job):
+        success = self.bot.send_message(job['approved'], job.get('chat'))
+        if success:
+            self.bot.log("✅ MESSAGE SENT SUCCESSFULLY!", Colors.GREEN)
+            self.bot.remember_reply(job.get('cache_key'), job['approved'])
+        else:
+            self.bot.log("❌ SEND FAILED - Please send manually", Colors.RED)
+
+    def run_approvals(self):
+        """Approval stage; runs on the calling (main) thread until the pipeline stops"""
+        try:
+            while self.running:
+                try:
+                    job = self.approve_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    self._approve(job)
+                finally:
+                    self.approve_queue.task_done()
+        finally:
+            self.stop()
+
+    def _approve(self, job):
+        if self._outdated(job):
+            return
+
+        shown = {'job': job, 'candidates': job.get('candidates')}
+
+        def refresh():
+            """(text, candidates) of a newer job for this chat, once per change; None while nothing changed"""
+            newest = self.bot.newest_job(shown['job'])
+            if newest is shown['job'] and newest.get('candidates') is shown['candidates']:
+                return None
+            if newest is not shown['job']:
+                self.bot.supersede_stats['refreshed'] += 1
+                self.bot.log(f" [🔄 Dialog now shows reply #{newest.get('seq')} for "
+                             f"{newest.get('chat') or 'this chat'}]", Colors.CYAN)
+            shown['job'], shown['candidates'] = newest, newest.get('candidates')
+            return newest['text'], shown['candidates']
+
+        self.bot.log(f"\n⏸️ Showing approval dialog ({self.approve_queue.qsize()} more waiting)...", Colors.YELLOW)
+        approved = self.bot.show_approval_dialog(job['text'], job['suggested'], job.get('chat'),
+                                                 candidates=job.get('candidates'), refresh=refresh)
+        job = shown['job']
+        self.bot.finish_job(job)
+        if approved:
+            self.bot.log(f"\n📤 User approved: '{approved}'", Colors.GREEN)
+            job['approved'] = approved
+            self._put(self.send_queue, job)
+        else:
+            self.bot.log("🚫 User cancelled", Colors.YELLOW)
+        self.bot.log("-" * 60, Colors.BLACK)
+
+class DriverLock:
+    """Re-entrant lock for the shared WebDriver that knows whether a stage is waiting for it.
+
+    The intake loop holds the driver through its long-polls; it calls
+    `after_waiters()` first so a context scrape or send that is already
+    queued gets the driver before the next poll starts.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.waiting = 0
+        self.count_lock = threading.Lock()
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            with self.count_lock:
+                self.waiting += 1
+            try:
+                self.lock.acquire()
+            finally:
+                with self.count_lock:
+                    self.waiting -= 1
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+    def after_waiters(self, timeout=2.0):
+        """Let stages already waiting for the driver go first; returns self for a `with` block"""
+        deadline = time.monotonic() + timeout
+        while self.waiting and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return self
+
+class StartupTimer:
+    """Wall-clock cost of each startup phase, reported once the bot is ready"""
+
+    def __init__(self):
+        self.phases = [("import", time.perf_counter() - IMPORT_STARTED)]
+        self.last = time.perf_counter()
+        self.animation_seen = LoadingAnimation.spent
+
+    def mark(self, phase):
+        """Close the phase that has been running since the previous mark (animations excluded)"""
+        now = time.perf_counter()
+        animation = LoadingAnimation.spent - self.animation_seen
+        self.phases.append((phase, max(0.0, now - self.last - animation)))
+        self.last = now
+        self.animation_seen = LoadingAnimation.spent
+
+    def report(self):
+        """One line per phase plus lazily imported modules, slowest first"""
+        lines = [" | ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases)]
+        total = sum(seconds for _, seconds in self.phases)
+        lines.append(f"total {total:.2f}s (+{LoadingAnimation.spent:.1f}s animations)")
+        imports = sorted(LazyImport.timings.items(), key=lambda item: -item[1])
+        if imports:
+            lines.append("imports: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in imports))
+        return lines
+
 class WhatsAppAIBot:
     def __init__(self):
+        self.startup = StartupTimer()
+        self.quiet = False  # set while benchmarking to silence per-reply logs
         self.config_file = "bot_config.json"
         self.config = self.load_config()
         self.driver = None
         self.last_message = ""
-        self.last_message_hash = ""  # Changed from ID to hash for better duplicate detection
-        self.message_history = set()  # Store hashes of all replied messages
+        self.last_message_hash = ""  # Identity key (chat + data-id + sender + timestamp) of the last new message
+        self.message_history = DedupeStore(  # Store hashes of all replied messages
+            self.config.get("dedupe_db", "repliq_dedupe.db"),
+            ttl_days=self.config.get("dedupe_ttl_days", 30),
+            max_entries=self.config.get("dedupe_max_entries", 50000),
+        )
+        self.migrate_replied_messages()
+        self.seen_messages = MessageIdentityIndex(self.config.get("identity_index_size", 10000))
+        self.image_cache = ImageCache(self.config.get("image_cache_dir", ".repliq_cache/images"))
+        self.pane_capture = PaneCapture(
+            max_bytes=self.config.get("screenshot_max_bytes", 150000),
+            max_side=self.config.get("screenshot_max_side", 1024),
+            image_format=self.config.get("screenshot_format", "JPEG"),
+            change_threshold=self.config.get("screenshot_change_threshold", 4),
+        )
+        self.active_chat = None
+        self.scan_anchors = {}  # chat title -> data-id of the newest row already scanned
+        self.chat_queues = {}  # chat title -> deque of messages waiting for a reply
+        self.chat_jobs = {}  # chat title -> newest pipeline job, tagged with its sequence number
+        self.chat_sequences = {}  # chat title -> sequence number of the newest job
+        self.jobs_lock = threading.Lock()
+        self.supersede_stats = {'superseded': 0, 'refreshed': 0}
+        self.bursts = BurstCoalescer(
+            quiet_seconds=self.config.get("burst_window_seconds", 2.5),
+            max_wait_seconds=self.config.get("burst_max_wait_seconds", 8),
+        )
+        self.driver_lock = DriverLock()  # one WebDriver command stream shared by all stages
+        self.pipeline = None
+        self.message_count = 0
+        self.last_send_result = None
+        self.selectors = SelectorRegistry(UI_SELECTORS, self.config.get("selector_preferences"))
+        self.candidate_pool = None  # created on first use, sized for reply_candidates x generation_workers
+        self.candidate_stats = {}  # slot -> {'shown', 'sent', 'edited'}
+        self.classifier = MessageClassifier(
+            max_bits=self.config.get("classifier_max_bits", 5.2),
+            min_random_length=self.config.get("classifier_min_random_length", 6),
+        ) if self.config.get("local_classifier", True) else None
+        self.local_stats = {'gibberish': 0, 'emoji': 0}  # replies answered without the model
+        self.prompt_budget = PromptBudget(
+            budget=self.config.get("prompt_token_budget", 1200),
+            line_tokens=self.config.get("context_line_tokens", 60),
+            message_tokens=self.config.get("message_token_budget", 300),
+            style_tokens=self.config.get("style_token_budget", 600),
+            image_tokens=self.config.get("image_token_estimate", 258),
+        )
+        self.scheduler = None  # RequestScheduler, sized for the backend in setup_llm
+        self.router = None  # ModelRouter, built in setup_llm
+        self.breaker = CircuitBreaker(
+            failure_threshold=self.config.get("circuit_failure_threshold", 5),
+            reset_seconds=self.config.get("circuit_reset_seconds", 30),
+            on_change=self.on_circuit_change,
+        )
+        self.resilience_stats = {'retries': 0, 'timeouts': 0, 'failures': 0}
+        self.reply_cache = ReplyCache(
+            max_entries=self.config.get("reply_cache_size", 500),
+            ttl_seconds=self.config.get("reply_cache_ttl_hours", 24) * 3600,
+            max_variants=self.config.get("reply_cache_variants", 5),
+            min_variants=self.config.get("reply_cache_min_variants", 2),
+        )
         self.monitoring = False
         self.model = None
+        self.startup.mark("config")
 
     def log(self, message, color=Colors.WHITE):
         """Enhanced logging with colors"""
+        if self.quiet:
+            return
         print(f"{color}{message}{Colors.RESET}", flush=True)
         sys.stdout.flush()
 
@@ -120,15 +2193,85 @@ class WhatsAppAIBot:
         return {
             "api_key": "",
             "custom_prompt": "",
-            "training_images": [],
-            "replied_messages": []  # New field to store replied message hashes
+            "training_images": []
         }
 
+    def migrate_replied_messages(self):
+        """Move the legacy replied_messages list out of bot_config.json into the dedupe store"""
+        legacy = self.config.pop("replied_messages", None)
+        if legacy is None:
+            return
+        self.message_history.migrate(legacy)
+        self.save_config()
+
     def save_config(self):
         """Save bot configuration"""
         with open(self.config_file, 'w', encoding='utf-8') as f:
             json.dump(self.config, f, indent=2, ensure_ascii=False)
 
+    def setup_llm(self):
+        """Pick the reply backend from config: Gemini (default) or an OpenAI-compatible endpoint"""
+        gemini = self.config.get("llm_backend", "gemini") != "openai"
+        if gemini:
+            self.setup_gemini()
+        else:
+            self.log("\n" + "="*60, Colors.CYAN)
+            self.log("🔑 STEP 1: Connecting to OpenAI-compatible backend", Colors.GREEN)
+            self.log("="*60, Colors.CYAN)
+            self.model = OpenAICompatibleBackend(
+                self.config.get("llm_base_url", "http://127.0.0.1:8765/v1"),
+                self.config.get("llm_model", "mock"),
+                api_key=self.config.get("llm_api_key", ""),
+                timeout=self.config.get("llm_timeout", 60),
+            )
+            self.log(f"✅ Using {self.model.name}", Colors.GREEN)
+        self.setup_rate_limits(gemini)
+        self.setup_router(gemini)
+
+    def setup_router(self, gemini=True):
+        """Per-request model choice; without router_* config it just wraps the model picked at startup"""
+        primary = self.model.model_name if gemini else self.model.model
+        fast = self.config.get("router_fast_models") or [primary]
+        strong = self.config.get("router_strong_models", [])
+
+        def make_backend(name):
+            if name == primary:
+                return self.model
+            if gemini:
+                return GeminiBackend(genai.GenerativeModel(name), name)
+            return OpenAICompatibleBackend(self.model.base_url, name, api_key=self.model.api_key,
+                                           timeout=self.model.timeout)
+
+        self.router = ModelRouter(fast, strong, make_backend,
+                                  slo_ms=self.config.get("latency_slo_ms", 3000),
+                                  max_error_rate=self.config.get("router_max_error_rate", 0.5),
+                                  recovery_seconds=self.config.get("router_recovery_seconds", 60))
+        if len(fast) + len(strong) > 1:
+            self.log(f"🧭 Model router: fast {fast}, strong {strong}", Colors.CYAN)
+
+    def route_features(self, incoming_message, media=False):
+        """Which model tier a reply needs, and why"""
+        words = incoming_message.split()
+        question = "?" in incoming_message or bool(words) and words[0].lower() in (
+            "what", "why", "how", "when", "where", "who", "which", "can", "could", "should",
+            "kya", "kyu", "kyun", "kaise", "kab", "kaha", "kahan", "kaun", "kitna")
+        if len(incoming_message) > self.config.get("router_escalate_chars", 120):
+            return {'tier': 'strong', 'reason': "long message"}
+        if question and len(words) >= self.config.get("router_question_words", 5):
+            return {'tier': 'strong', 'reason': "question"}
+        if media and self.config.get("router_escalate_on_images", True):
+            return {'tier': 'strong', 'reason': "incoming media"}
+        return {'tier': 'fast', 'reason': "short message"}
+
+    def setup_rate_limits(self, gemini=True):
+        """Client-side quota: Gemini free-tier limits by default, none for self-hosted endpoints"""
+        headroom = self.config.get("rate_limit_headroom", 0.9)  # stay just under the real quota
+        rpm = self.config.get("rate_limit_rpm", 15 if gemini else 0)
+        tpm = self.config.get("rate_limit_tpm", 1000000 if gemini else 0)
+        self.scheduler = RequestScheduler(rpm=rpm * headroom, tpm=tpm * headroom)
+        if rpm or tpm:
+            self.log(f"🚦 Rate limit: {rpm * headroom:.0f} requests/min, {tpm * headroom:,.0f} tokens/min", Colors.CYAN)
+
     def setup_gemini(self):
         """Initialize Google Gemini API with enhanced visuals"""
         self.log("\n" + "="*60, Colors.CYAN)
@@ -150,31 +2293,20 @@ class WhatsAppAIBot:
             self.log("✅ Using saved API key", Colors.GREEN)
 
         try:
+            started = time.perf_counter()
             genai.configure(api_key=self.config["api_key"])
-            models_to_try = [
-                'gemini-1.5-flash-latest',
-                'gemini-1.5-flash',
-                'gemini-pro',
-                'gemini-1.5-pro-latest'
-            ]
-
-            self.model = None
-            last_error = None
-            for model_name in models_to_try:
-                try:
-                    self.log(f" Trying model: {model_name}...", Colors.WHITE)
-                    test_model = genai.GenerativeModel(model_name)
-                    test_response = test_model.generate_content("Say 'hi' in one word")
-                    self.model = test_model
-                    self.log(f"✅ Connected to {model_name}!", Colors.GREEN)
-                    break
-                except Exception as e:
-                    last_error = e
-                    self.log(f" ❌ {model_name} failed", Colors.RED)
-                    continue
+            remembered = self.config.get("gemini_model")
 
-            if not self.model:
-                raise last_error
+            if remembered and self.config.get("lazy_model_validation", True):
+                # No probe call: the first real reply validates it (and rediscovers if it fails)
+                self.model = GeminiBackend(genai.GenerativeModel(remembered), remembered,
+                                           rediscover=self.find_working_gemini_model)
+                self.log(f"✅ Using last working model {remembered} (checked on first reply)", Colors.GREEN)
+            else:
+                model, model_name = self.find_working_gemini_model()
+                self.model = GeminiBackend(model, model_name)
+
+            self.log(f"⏱️ Model ready in {(time.perf_counter() - started) * 1000:.0f}ms", Colors.CYAN)
 
             LoadingAnimation.show_loading_bar()
             LoadingAnimation.show_authenticator()
@@ -185,6 +2317,51 @@ class WhatsAppAIBot:
             self.save_config()
             exit()
 
+    def probe_gemini_models(self, model_names):
+        """Test-generate on all candidates at once; returns (model, name) for the most preferred that works"""
+        def probe(model_name):
+            test_model = genai.GenerativeModel(model_name)
+            test_model.generate_content("Say 'hi' in one word")
+            return test_model
+
+        if not model_names:
+            return None, None
+        pool = ThreadPoolExecutor(max_workers=len(model_names))
+        try:
+            futures = [(name, pool.submit(probe, name)) for name in model_names]
+            for model_name, future in futures:
+                try:
+                    model = future.result()
+                except Exception as e:
+                    self.log(f" ❌ {model_name} failed: {str(e)[:80]}", Colors.RED)
+                    continue
+                self.log(f"✅ Connected to {model_name}!", Colors.GREEN)
+                return model, model_name
+            return None, None
+        finally:
+            # Don't wait on less preferred probes still in flight
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def find_working_gemini_model(self, exclude=None):
+        """Probe the known model names concurrently, then fall back to listing the account's models"""
+        candidates = [name for name in GEMINI_MODEL_CANDIDATES if name != exclude]
+        self.log(f" Probing {len(candidates)} models in parallel...", Colors.WHITE)
+        model, model_name = self.probe_gemini_models(candidates)
+
+        if model is None:
+            self.log(" Listing available models...", Colors.YELLOW)
+            discovered = [m.name.replace('models/', '') for m in genai.list_models()
+                          if 'generateContent' in m.supported_generation_methods]
+            model, model_name = self.probe_gemini_models(
+                [name for name in discovered if name not in candidates and name != exclude][:8])
+
+        if model is None:
+            raise RuntimeError("No Gemini model accepted a test request")
+
+        self.config["gemini_model"] = model_name
+        self.save_config()
+        return model, model_name
+
     def setup_training_data(self):
         """Setup custom prompt and training images"""
         self.log("\n" + "="*60, Colors.CYAN)
@@ -247,43 +2424,105 @@ class WhatsAppAIBot:
             options.add_argument("--start-maximized")
             options.add_experimental_option("excludeSwitches", ["enable-automation"])
             options.add_experimental_option('useAutomationExtension', False)
+            options.page_load_strategy = 'eager'  # readiness is decided by wait_until_ready, not the load event
 
-            self.log("📦 Installing ChromeDriver...", Colors.WHITE)
-            service = Service(ChromeDriverManager().install())
+            driver_path = self.resolve_chromedriver()
+            service = Service(driver_path) if driver_path else Service()  # no path: Selenium Manager resolves it
             self.driver = webdriver.Chrome(service=service, options=options)
             self.log("✅ Chrome opened!", Colors.GREEN)
 
             self.log("\n🌐 Loading WhatsApp Web...", Colors.WHITE)
             self.driver.get("https://web.whatsapp.com")
+            self.startup.mark("browser")
 
-            self.log("\n" + "="*60, Colors.CYAN)
-            self.log("📱 SCAN QR CODE", Colors.YELLOW)
-            self.log("="*60, Colors.CYAN)
-            self.log("\n Waiting 120 seconds for scan...\n", Colors.WHITE)
-
-            try:
-                WebDriverWait(self.driver, 120).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "[data-testid='chat-list']"))
-                )
-                self.log("\n✅ WhatsApp connected!", Colors.GREEN)
-            except:
-                self.log("\n Trying alternative method...", Colors.YELLOW)
-                WebDriverWait(self.driver, 30).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div[role='textbox']"))
-                )
-                self.log("\n✅ WhatsApp connected!", Colors.GREEN)
-            time.sleep(3)
+            if not self.wait_until_ready(session_dir):
+                raise TimeoutException("WhatsApp did not finish loading (QR not scanned?)")
+            self.startup.mark("login")
+            self.save_selector_preferences()
+            self.log("\n✅ WhatsApp connected!", Colors.GREEN)
 
         except Exception as e:
             self.log(f"\n❌ Error: {str(e)}", Colors.RED)
             if self.driver:
                 self.driver.quit()
-            input("\nPress Enter to exit...")
+            if sys.stdin.isatty():  # no prompt when running as a service
+                input("\nPress Enter to exit...")
             exit()
 
-    def get_message_hash(self, message_text):
-        """Generate hash of message to detect duplicates"""
-        return hashlib.sha256(message_text.encode()).hexdigest()
+    def resolve_chromedriver(self):
+        """Pinned ChromeDriver path if it still matches the local Chrome, else install one and pin it"""
+        pinned = self.config.get("chromedriver") or {}
+        path = self.config.get("chromedriver_path") or pinned.get("path")
+        chrome_major = DriverResolver.chrome_major(self.config.get("chrome_binary"))
+
+        if path and os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            same_file = pinned.get("path") == path and pinned.get("mtime") == mtime
+            driver_major = pinned.get("major") if same_file else DriverResolver.driver_major(path)
+            if chrome_major is None or driver_major is None or driver_major == chrome_major:
+                self.log(f"📦 Using pinned ChromeDriver {driver_major or '?'} (Chrome {chrome_major or '?'})", Colors.WHITE)
+                if not same_file:
+                    self.pin_chromedriver(path, driver_major)
+                return path
+            self.log(f"⚠️ Pinned ChromeDriver {driver_major} does not match Chrome {chrome_major}, updating...", Colors.YELLOW)
+
+        self.log("📦 Installing ChromeDriver...", Colors.WHITE)
+        try:
+            installed = ChromeDriverManager().install()
+        except Exception as e:
+            if path and os.path.exists(path):
+                self.log(f"⚠️ ChromeDriver lookup failed ({e}), trying the pinned driver anyway", Colors.YELLOW)
+                return path
+            self.log(f"⚠️ ChromeDriver lookup failed ({e}), leaving it to Selenium Manager", Colors.YELLOW)
+            return None
+        self.pin_chromedriver(installed, DriverResolver.driver_major(installed))
+        return installed
+
+    def pin_chromedriver(self, path, major):
+        """Remember a working driver so the next start needs no version lookup"""
+        self.config["chromedriver"] = {"path": path, "major": major, "mtime": os.path.getmtime(path)}
+        self.config.pop("chromedriver_path", None)
+        self.save_config()
+
+    def wait_until_ready(self, session_dir):
+        """Poll until the chat list renders; the QR prompt (and its longer timeout) only if WhatsApp asks for a scan"""
+        has_session = os.path.isdir(os.path.join(session_dir, "Default"))
+        login_timeout = self.config.get("login_timeout", 150)
+        deadline = time.time() + (self.config.get("session_ready_timeout", 60) if has_session else login_timeout)
+        if has_session:
+            self.log("\n⏳ Restoring saved WhatsApp session...", Colors.WHITE)
+        qr_prompted = False
+
+        while time.time() < deadline:
+            try:
+                probe = self.driver.execute_script(READINESS_JS, self.selectors.ordered('logged_in'),
+                                                   self.selectors.ordered('qr_code')) or {}
+            except Exception:
+                probe = {}  # page still navigating
+            if probe.get('state') == 'ready':
+                self.selectors.record('logged_in', probe['selector'])
+                return True
+            if probe.get('state') == 'qr' and not qr_prompted:
+                qr_prompted = True
+                deadline = time.time() + login_timeout
+                self.log("\n" + "="*60, Colors.CYAN)
+                self.log("📱 SCAN QR CODE", Colors.YELLOW)
+                self.log("="*60, Colors.CYAN)
+                self.log(f"\n Waiting {login_timeout} seconds for scan...\n", Colors.WHITE)
+            time.sleep(0.1)
+        return False
+
+    def save_selector_preferences(self):
+        """Persist the selector variants that worked, so the next run tries them first"""
+        if self.selectors.changed:
+            self.selectors.changed = False
+            self.config["selector_preferences"] = dict(self.selectors.preferred)
+            self.save_config()
+
+    def message_key(self, chat, row, text=None):
+        """Identity key for a parsed bubble (chat + data-id + sender + timestamp)"""
+        return MessageIdentityIndex.key_for(chat, row.get('id'), row.get('sender'), row.get('timestamp'),
+                                            text if text is not None else row.get('text'))
 
     def encode_image(self, image_path):
         """Encode image for Gemini"""
@@ -301,12 +2540,21 @@ class WhatsAppAIBot:
             self.log(f" ⚠️ Image encoding error: {e}", Colors.YELLOW)
             return None
 
-    def take_screenshot(self):
-        """Take screenshot of WhatsApp for better context"""
+    def take_screenshot(self, chat=None):
+        """Screenshot the conversation pane as a compact image part, or None if unchanged/failed"""
         try:
-            self.log(" [📸 Taking full screenshot for context...]", Colors.CYAN)
-            screenshot = self.driver.get_screenshot_as_png()
-            return screenshot
+            self.log(" [📸 Capturing conversation pane for context...]", Colors.CYAN)
+            pane = self.selectors.find(self.driver, 'conversation_pane')
+            if pane is not None:
+                screenshot = pane.screenshot_as_png
+            else:
+                screenshot = self.driver.get_screenshot_as_png()
+            part = self.pane_capture.prepare(screenshot, chat)
+            if part is None:
+                self.log(" [📸 Pane unchanged since last reply - skipping image]", Colors.WHITE)
+            else:
+                self.log(f" [📸 {len(screenshot) // 1024} KB capture -> {len(part['data']) // 1024} KB {part['mime_type']}]", Colors.WHITE)
+            return part
         except Exception as e:
             self.log(f" [⚠️ Screenshot failed: {e}]", Colors.YELLOW)
             return None
@@ -317,23 +2565,9 @@ class WhatsAppAIBot:
             self.log(" [📖 Reading full conversation context...]", Colors.CYAN)
             all_messages = []
 
-            incoming = self.driver.find_elements(By.CSS_SELECTOR, "div[class*='message-in']")
-            for msg in incoming[-10:]:
-                try:
-                    text = msg.find_element(By.CSS_SELECTOR, "span.selectable-text").text
-                    if text.strip():
-                        all_messages.append(f"Them: {text.strip()}")
-                except:
-                    pass
-
-            outgoing = self.driver.find_elements(By.CSS_SELECTOR, "div[class*='message-out']")
-            for msg in outgoing[-10:]:
-                try:
-                    text = msg.find_element(By.CSS_SELECTOR, "span.selectable-text").text
-                    if text.strip():
-                        all_messages.append(f"You: {text.strip()}")
-                except:
-                    pass
+            for msg in self.fetch_recent_messages(20):
+                speaker = "Them" if msg['direction'] == 'in' else "You"
+                all_messages.append(f"{speaker}: {msg['text']}")
 
             if all_messages:
                 context = "\n".join(all_messages[-15:])
@@ -345,165 +2579,607 @@ class WhatsAppAIBot:
             self.log(f" [⚠️ Context reading failed: {e}]", Colors.YELLOW)
             return None
 
-    def generate_reply(self, incoming_message):
-        """Generate AI reply with full screenshot and context"""
-        try:
-            self.log(f" [Generating intelligent reply...]", Colors.CYAN)
+    def gather_reply_context(self, chat=None, media=False):
+        """Read conversation context and screenshot for a chat in one driver session"""
+        with self.driver_lock:
+            if chat and not self.open_chat(chat):
+                return {'context': None, 'screenshot': None, 'media': media}
+            return {
+                'context': self.get_conversation_context(),
+                'screenshot': self.take_screenshot(chat or self.active_chat),
+                'media': media,  # the message itself carries a photo/video, not just the context
+            }
 
-            conversation_context = self.get_conversation_context()
-            screenshot = self.take_screenshot()
+    def build_reply_request(self, incoming_message, reply_context=None):
+        """Prompt parts (text, screenshot, training images), generation config and routing features for one reply"""
+        if reply_context is None:
+            reply_context = self.gather_reply_context()
+        conversation_context = reply_context['context']
+        screenshot = reply_context['screenshot']
+
+        # Kept even with the local classifier on: it only catches the clear-cut cases
+        instructions = [
+            "Analyze the message carefully - Is it a real message or gibberish?",
+            'If gibberish (random letters) → ask "You okay?" or "Did you mean something?" or "???"',
+            "If real → respond naturally and match the conversation",
+            "Show you understood the message",
+            "Keep it 1-3 sentences, natural and conversational",
+            "Write ONLY your reply, no explanations",
+        ]
+        instructions = "\n".join(f"{i}. {line}" for i, line in enumerate(instructions, 1))
+        budget = self.prompt_budget
+        style = budget.clip(self.config['custom_prompt'], budget.style_tokens)
+        message = budget.clip(incoming_message, budget.message_tokens)
+        heading = "NEW MESSAGES TO REPLY TO (sent back to back - answer them together in one reply):" \
+            if "\n" in message else "NEW MESSAGE TO REPLY TO:"
 
-            system_prompt = f"""You are texting as this person. Analyze the message and respond naturally.
+        def render(context):
+            return f"""You are texting as this person. Analyze the message and respond naturally.
 
 YOUR TEXTING STYLE:
-{self.config['custom_prompt']}
+{style}
 
 RECENT CONVERSATION:
-{conversation_context if conversation_context else "No previous messages"}
+{context if context else "No previous messages"}
 
-NEW MESSAGE TO REPLY TO:
-"{incoming_message}"
+{heading}
+"{message}"
 
 INSTRUCTIONS:
-1. Analyze the message carefully - Is it a real message or gibberish?
-2. If gibberish (random letters) → ask "You okay?" or "Did you mean something?" or "???"
-3. If real → respond naturally and match the conversation
-4. Show you understood the message
-5. Keep it 1-3 sentences, natural and conversational
-6. Write ONLY your reply, no explanations
+{instructions}
 
 YOUR REPLY:"""
 
-            content_parts = [system_prompt]
+        context_lines = conversation_context.splitlines() if conversation_context else []
+        system_prompt, kept, dropped = budget.fit(render, context_lines)
+        content_parts = [system_prompt]
+
+        if screenshot:
+            content_parts.append(screenshot)
+            self.log(" [🖼️ Conversation screenshot included for context]", Colors.GREEN)
+
+        if self.config.get("training_images"):
+            self.log(f" [📚 Using {len(self.config['training_images'])} training images]", Colors.YELLOW)
+            for img_path in self.config["training_images"][:2]:
+                if os.path.exists(img_path):
+                    img_data = self.image_cache.get(img_path, self.encode_image)
+                    if img_data:
+                        content_parts.append({
+                            'mime_type': 'image/jpeg',
+                            'data': img_data
+                        })
+
+        text_tokens = budget.estimate(system_prompt)
+        image_tokens = budget.record(text_tokens, len(content_parts) - 1, dropped)
+        trimmed = f", dropped {dropped} oldest context lines" if dropped else ""
+        self.log(f" [🧮 Prompt ~{text_tokens} text tokens (budget {budget.budget}) + ~{image_tokens} image tokens, "
+                 f"{kept}/{len(context_lines)} context lines{trimmed}]", Colors.CYAN)
+        if self.config.get("token_counter") == "model" and hasattr(self.model, 'count_tokens'):
+            try:
+                self.log(f" [🧮 count_tokens: {self.model.count_tokens(content_parts)} tokens]", Colors.CYAN)
+            except Exception as e:
+                self.log(f" [⚠️ count_tokens failed: {e}]", Colors.YELLOW)
 
-            if screenshot:
-                content_parts.append({
-                    'mime_type': 'image/png',
-                    'data': screenshot
-                })
-                self.log(" [🖼️ Full screenshot included for context]", Colors.GREEN)
-
-            if self.config.get("training_images"):
-                self.log(f" [📚 Using {len(self.config['training_images'])} training images]", Colors.YELLOW)
-                for img_path in self.config["training_images"][:2]:
-                    if os.path.exists(img_path):
-                        img_data = self.encode_image(img_path)
-                        if img_data:
-                            content_parts.append({
-                                'mime_type': 'image/jpeg',
-                                'data': img_data
-                            })
-
-            generation_config = {
-                'temperature': 1.1,
-                'top_p': 0.95,
-                'top_k': 50,
-                'max_output_tokens': 200,
-            }
+        generation_config = {
+            'temperature': 1.1,
+            'top_p': 0.95,
+            'top_k': 50,
+            'max_output_tokens': 200,
+        }
+        return content_parts, generation_config, self.route_features(incoming_message, reply_context.get('media'))
+
+    def clean_reply(self, reply):
+        """Strip quotes, "Reply:"-style prefixes and markdown from raw model text; None if nothing is left"""
+        reply = (reply or "").strip()
+        self.log(f" [Raw response: '{reply[:50]}...']", Colors.WHITE)
+
+        if reply.startswith('\"') and reply.endswith('\"'):
+            reply = reply[1:-1].strip()
+        if reply.startswith("'") and reply.endswith("'"):
+            reply = reply[1:-1].strip()
+
+        prefixes = [
+            "Reply:", "Response:", "Answer:", "Message:", "Your reply:",
+            "reply:", "response:", "answer:", "message:", "your reply:"
+        ]
+        for prefix in prefixes:
+            if reply.lower().startswith(prefix.lower()):
+                reply = reply[len(prefix):].strip()
+
+        reply = reply.strip('*_~`')
+        return reply or None
+
+    def generate_reply(self, incoming_message, reply_context=None):
+        """Generate AI reply with full screenshot and context"""
+        try:
+            self.log(f" [Generating intelligent reply...]", Colors.CYAN)
+            content_parts, generation_config, route = self.build_reply_request(incoming_message, reply_context)
 
             self.log(" [🤖 Calling Gemini AI...]", Colors.CYAN)
-            response = self.model.generate_content(
-                content_parts,
-                generation_config=generation_config
+            response = self.call_model(
+                lambda backend, timeout: backend.generate_content(content_parts, generation_config=generation_config,
+                                                                  timeout=timeout),
+                self.request_tokens(content_parts, generation_config),
+                route=route,
             )
 
             if not response or not response.text:
                 self.log(" [Empty response from API]", Colors.YELLOW)
                 return "Hey! 👋"
 
-            reply = response.text.strip()
-            self.log(f" [Raw response: '{reply[:50]}...']", Colors.WHITE)
-
-            if reply.startswith('\"') and reply.endswith('\"'):
-                reply = reply[1:-1].strip()
-            if reply.startswith("'") and reply.endswith("'"):
-                reply = reply[1:-1].strip()
-
-            prefixes = [
-                "Reply:", "Response:", "Answer:", "Message:", "Your reply:",
-                "reply:", "response:", "answer:", "message:", "your reply:"
-            ]
-            for prefix in prefixes:
-                if reply.lower().startswith(prefix.lower()):
-                    reply = reply[len(prefix):].strip()
-
-            reply = reply.strip('*_~`')
-
-            if not reply or len(reply) < 1:
+            reply = self.clean_reply(response.text)
+            if not reply:
                 self.log(" [Reply too short, using fallback]", Colors.YELLOW)
                 return "Hey! 👋"
 
             self.log(f" [✅ Final reply: '{reply}']", Colors.GREEN)
             return reply
 
+        except CircuitOpenError:
+            return self.fallback_reply()
         except Exception as e:
             self.log(f" ❌ Error generating reply: {e}", Colors.RED)
-            return "Hey! Let me get back to you 😊"
+            return self.fallback_reply()
 
-    def get_last_message(self):
-        """Get last incoming message with improved detection"""
-        try:
-            time.sleep(1)
-            messages = self.driver.find_elements(By.CSS_SELECTOR, "div[class*='message-in']")
+    def reply_cache_key(self, text, chat=None):
+        """Reply cache key for `text`, or None when the cache is off or bypassed for it"""
+        if not self.config.get("reply_cache", True):
+            return None
+        if chat and chat in self.config.get("reply_cache_bypass_chats", []):
+            return None  # chats where the conversation always matters
+        if len(text.split()) > self.config.get("reply_cache_max_words", 4):
+            return None  # longer messages need context, not a stock answer
+        return ReplyCache.key_for(text, self.config.get("custom_prompt", ""))
+
+    def instant_candidates(self, text, cache_key):
+        """Candidates that need no model call: a local response, a reply cache hit or an outage fallback; else None"""
+        return self.local_candidates(text) or self.cached_candidates(cache_key) or self.outage_candidates()
+
+    def finished_candidates(self, replies):
+        """Ready-made replies as finished candidates, at most reply_candidates of them"""
+        candidates = []
+        for slot, reply in enumerate(replies[:self.candidate_count()]):
+            candidate = ReplyStream(slot)
+            candidate.finish(reply)
+            candidates.append(candidate)
+        return candidates
+
+    def local_candidates(self, text):
+        """Configured local replies for gibberish or emoji-only messages, or None"""
+        label = self.classifier.classify(text) if self.classifier else None
+        if not label:
+            return None
+        local_replies = self.config.get("local_replies", {
+            "gibberish": ["???", "You okay?", "Did you mean something?"],
+            "emoji": ["{echo}"],  # mirror the emoji back
+        })
+        replies = [reply.replace("{echo}", text.strip()) for reply in local_replies.get(label) or []]
+        if not replies:
+            return None  # no local response configured for this kind: let the model answer
+        self.local_stats[label] += 1
+        self.log(f"⚡ Looks like {label}, answering locally (no API call)", Colors.GREEN)
+        return self.finished_candidates(random.sample(replies, len(replies)))
+
+    def cached_candidates(self, cache_key):
+        """Finished candidates from the reply cache, or None on a miss"""
+        variants = self.reply_cache.get(cache_key) if cache_key else None
+        if not variants:
+            return None
+        self.reply_cache.stats['calls_avoided'] += self.candidate_count()
+        self.log(f"♻️ Reply cache hit ({len(variants)} variants), no API call", Colors.GREEN)
+        return self.finished_candidates(variants)
+
+    def remember_reply(self, cache_key, reply):
+        """Offer a sent reply to the reply cache"""
+        if cache_key and reply:
+            self.reply_cache.add(cache_key, reply)
+
+    def message_priority(self, message_data):
+        """Scheduling priority (lower first): VIP chats, then the newest messages"""
+        vip = message_data.get('chat') in self.config.get("vip_chats", [])
+        return (0 if vip else 1, -time.time())
+
+    def request_tokens(self, content_parts, generation_config):
+        """Estimated tokens one request will use against the TPM quota"""
+        budget = self.prompt_budget
+        return (budget.estimate(content_parts[0]) + (len(content_parts) - 1) * budget.image_tokens
+                + generation_config.get('max_output_tokens', 0))
 
-            if not messages:
-                messages = self.driver.find_elements(By.XPATH, "//div[contains(@class, 'message-in')]")
+    @staticmethod
+    def is_rate_limited(error):
+        """True for quota errors (HTTP 429 / ResourceExhausted)"""
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code == 429
+        return isinstance(error, google_api_errors("ResourceExhausted", "TooManyRequests"))
 
-            if not messages:
-                return None
+    @staticmethod
+    def retry_after(error, default=20.0):
+        """Server-suggested wait in seconds, if the error carries one"""
+        match = re.search(r"retry[ _-]?(?:in|after|delay)?\D{0,20}?(\d+(?:\.\d+)?)", str(error), re.IGNORECASE)
+        return float(match.group(1)) if match else default
 
-            last_msg = messages[-1]
+    @staticmethod
+    def is_retryable(error):
+        """Worth another try: timeouts, dropped connections, 5xx and quota errors (not bad requests or bad keys)"""
+        if isinstance(error, urllib.error.HTTPError):  # before URLError, which it subclasses
+            return error.code == 429 or error.code >= 500
+        if isinstance(error, google_api_errors("ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+                                               "ResourceExhausted", "TooManyRequests")):
+            return True
+        return isinstance(error, (TimeoutError, ConnectionError, urllib.error.URLError))
+
+    def on_circuit_change(self, state, failures):
+        """Log circuit breaker transitions"""
+        if state == 'open':
+            self.log(f"⛔ Model API failing ({failures} in a row): local fallback replies for "
+                     f"{self.breaker.reset_seconds:.0f}s", Colors.RED)
+        elif state == 'half_open':
+            self.log("🩺 Probing the model API again...", Colors.YELLOW)
+        else:
+            self.log("✅ Model API recovered", Colors.GREEN)
+
+    def pick_model(self, route, tried):
+        """(name, backend) for this attempt: the router's best model not yet tried in this call"""
+        if self.router is None:
+            return None, self.model
+        ranked = self.router.ranked(route.get('tier', 'fast'))
+        name = next((name for name in ranked if name not in tried), ranked[0])
+        if len(ranked) > 1:
+            action = "failing over to" if tried else "routing to"
+            self.log(f" [🧭 {action} {name} ({route.get('tier', 'fast')}: {route.get('reason', '-')})]", Colors.CYAN)
+        return name, self.router.backend(name)
+
+    def call_model(self, request, tokens, priority=None, route=None, cancelled=None):
+        """Run `request(backend, timeout)` behind the circuit breaker and rate limiter, retrying transient errors.
+
+        Each attempt goes to the router's best model for `route`, skipping
+        models that already failed this call. Retries use jittered
+        exponential backoff; a 429 instead pauses the limiter for the
+        server's retry delay. Raises CircuitOpenError while the API is
+        considered down, and ReplyCancelled once the `cancelled` event is set
+        (checked again after waiting for the rate limiter).
+        """
+        retries = self.config.get("model_retries", 3)
+        timeout = self.config.get("request_timeout", 20)
+        tried = set()
+        for attempt in range(retries + 1):
+            if cancelled is not None and cancelled.is_set():
+                raise ReplyCancelled()
+            if not self.breaker.allow():
+                raise CircuitOpenError("model API circuit is open")
+            try:
+                if self.scheduler:
+                    waited = self.scheduler.acquire(tokens, priority or (1, 0))
+                    if waited > 1:
+                        self.log(f" [🚦 Waited {waited:.1f}s for rate limit]", Colors.YELLOW)
+                if cancelled is not None and cancelled.is_set():
+                    raise ReplyCancelled()
+                name, backend = self.pick_model(route or {}, tried)
+            except BaseException:
+                self.breaker.release()  # no call went out, so there is no outcome to record
+                raise
+            started = time.perf_counter()
+            try:
+                result = request(backend, timeout)
+            except Exception as e:
+                if name:
+                    self.router.record(name, time.perf_counter() - started, False)
+                    tried.add(name)
+                retryable = self.is_retryable(e)
+                if retryable and not self.is_rate_limited(e):
+                    self.breaker.record_failure()  # quota errors mean "slow down", not "down"
+                else:
+                    self.breaker.record_success()  # the API answered, even if it said no
+                if self.is_timeout(e):
+                    self.resilience_stats['timeouts'] += 1
+                if not retryable or attempt == retries:
+                    self.resilience_stats['failures'] += 1
+                    raise
+                self.resilience_stats['retries'] += 1
+                if self.is_rate_limited(e):
+                    delay = self.retry_after(e)
+                    self.log(f" [🚦 Over quota, pausing requests for {delay:.0f}s]", Colors.YELLOW)
+                    if self.scheduler:
+                        self.scheduler.throttle(delay)
+                    else:
+                        time.sleep(delay)
+                else:
+                    base = self.config.get("retry_base_seconds", 0.5)
+                    delay = min(self.config.get("retry_max_seconds", 8), base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    self.log(f" [🔁 {str(e)[:60]} — retry {attempt + 1}/{retries} in {delay:.1f}s]", Colors.YELLOW)
+                    time.sleep(delay)
+                continue
+            if name:
+                self.router.record(name, time.perf_counter() - started, True)
+            self.breaker.record_success()
+            return result
 
-            text_elements = last_msg.find_elements(By.CSS_SELECTOR, "span.selectable-text")
-            if text_elements:
-                text = " ".join([el.text.strip() for el in text_elements if el.text.strip()])
-            else:
-                text = last_msg.text.strip()
+    @staticmethod
+    def is_timeout(error):
+        if isinstance(error, urllib.error.URLError) and not isinstance(error, urllib.error.HTTPError):
+            error = error.reason  # connect timeouts arrive wrapped
+        return isinstance(error, (TimeoutError, *google_api_errors("DeadlineExceeded")))
 
-            lines = text.split('\n')
-            clean_lines = [line.strip() for line in lines
-                          if line.strip() and not line.strip().isdigit()
-                          and len(line.strip()) > 2]
-            text = ' '.join(clean_lines) if clean_lines else text
+    def fallback_replies(self):
+        """Canned replies for when the model is unavailable"""
+        return self.config.get("fallback_replies") or ["Hey! Let me get back to you 😊"]
 
-            if text and len(text) > 0:
-                msg_hash = self.get_message_hash(text)
-                self.log(f" ✅ Found message: {text[:60]}...", Colors.GREEN)
-                return {'text': text, 'hash': msg_hash}
+    def fallback_reply(self):
+        return random.choice(self.fallback_replies())
 
+    def outage_candidates(self):
+        """Local fallback candidates while the circuit is open, so no context is gathered for nothing"""
+        if not self.breaker.is_open():
             return None
+        self.breaker.stats['short_circuited'] += 1
+        self.log("⛔ Model API down, offering local fallback replies", Colors.YELLOW)
+        replies = self.fallback_replies()
+        return self.finished_candidates(random.sample(replies, len(replies)))
+
+    def open_stream(self, backend, content_parts, generation_config, timeout=None):
+        """Start a streamed reply; returns (chunk generator, first chunk) so request errors surface here"""
+        chunks = backend.stream_content(content_parts, generation_config=generation_config, timeout=timeout)
+        try:
+            return chunks, next(chunks, None)
+        except Exception:
+            chunks.close()
+            raise
+
+    def candidate_count(self):
+        """Suggestions per message; each one is a separate model request, so more than one is opt-in"""
+        return max(1, self.config.get("reply_candidates", 1))
+
+    def new_candidates(self):
+        """Empty ReplyStreams, one per configured reply candidate"""
+        return [ReplyStream(slot) for slot in range(self.candidate_count())]
+
+    def generate_candidates(self, incoming_message, reply_context, candidates, streaming=True, priority=None):
+        """Fill every candidate in parallel from one prompt, each at its own temperature; returns when all are done"""
+        try:
+            content_parts, generation_config, route = self.build_reply_request(incoming_message, reply_context)
+        except Exception as e:
+            self.log(f" ❌ Error generating reply: {e}", Colors.RED)
+            for candidate in candidates:
+                candidate.finish(self.fallback_reply())
+            return
+
+        if len(candidates) == 1:
+            self.fill_candidate(candidates[0], content_parts, generation_config, streaming, priority, route)
+            return
+        if self.candidate_pool is None:
+            workers = len(candidates) * self.config.get("generation_workers", 2)
+            self.candidate_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="repliq-candidate")
+        temperatures = self.config.get("candidate_temperatures", [1.1, 0.7, 1.5])
+        self.log(f" [Generating {len(candidates)} candidates...]", Colors.CYAN)
+        futures = [
+            self.candidate_pool.submit(self.fill_candidate, candidate, content_parts,
+                                       dict(generation_config, temperature=temperatures[candidate.slot % len(temperatures)]),
+                                       streaming, priority, route)
+            for candidate in candidates
+        ]
+        for future in futures:
+            future.result()
+
+    def fill_candidate(self, stream, content_parts, generation_config, streaming=True, priority=None, route=None):
+        """Generate one reply into `stream` (chunk by chunk when streaming); stops early once it is cancelled"""
+        reply = None
+        source = None
+        label = f" #{stream.slot + 1}" if stream.slot else ""
+        tokens = self.request_tokens(content_parts, generation_config)
+        try:
+            if streaming:
+                source, first = self.call_model(
+                    lambda backend, timeout: self.open_stream(backend, content_parts, generation_config, timeout),
+                    tokens, priority, route, stream.cancelled)
+                chunks = itertools.chain([first] if first is not None else [], source)
+            else:
+                response = self.call_model(
+                    lambda backend, timeout: backend.generate_content(content_parts, generation_config=generation_config,
+                                                                      timeout=timeout),
+                    tokens, priority, route, stream.cancelled)
+                chunks = [response.text]
+            for chunk in chunks:
+                stream.push(chunk or "")
+                if stream.cancelled.is_set():
+                    break
+
+            if stream.cancelled.is_set():
+                self.log(f" [✋ Reply{label} cancelled after {len(stream.text)} chars]", Colors.YELLOW)
+                return
+            if streaming and stream.first_token_ms is not None:
+                self.log(f" [⚡ Reply{label} first token after {stream.first_token_ms:.0f}ms]", Colors.CYAN)
+            reply = self.clean_reply(stream.text)
+            if not reply:
+                self.log(" [Empty response from API, using fallback]", Colors.YELLOW)
+                reply = "Hey! 👋"
+            self.log(f"💡 AI Suggested{label}: '{reply}'", Colors.GREEN)
+
+        except ReplyCancelled:
+            self.log(f" [✋ Reply{label} cancelled before it was requested]", Colors.YELLOW)
+        except CircuitOpenError:
+            reply = stream.text.strip() or self.fallback_reply()
+        except Exception as e:
+            self.log(f" ❌ Error generating reply: {e}", Colors.RED)
+            reply = stream.text.strip() or self.fallback_reply()
+        finally:
+            if source is not None:
+                source.close()  # abandons the rest of the response if we stopped early
+            stream.finish(reply)
+
+    def get_last_message(self):
+        """Get last incoming message with improved detection"""
+        try:
+            new_messages = self.scan_new_messages()
+            return new_messages[-1] if new_messages else None
 
         except Exception as e:
             self.log(f" ❌ Error getting message: {e}", Colors.RED)
             return None
 
-    def send_message(self, message):
+    def scan_new_messages(self, limit=20, first_visit=1):
+        """Return incoming messages added after the remembered anchor of the open chat"""
+        limit = max(limit, first_visit)
+        anchor = self.scan_anchors.get(self.active_chat)
+        result = self.driver.execute_script(SCAN_NEW_MESSAGES_JS, anchor, limit)
+        if not result:
+            return []
+
+        if result.get('chat') != self.active_chat:
+            # Chat switched since the last scan - rescan against that chat's own anchor
+            self.active_chat = result.get('chat')
+            anchor = self.scan_anchors.get(self.active_chat)
+            result = self.driver.execute_script(SCAN_NEW_MESSAGES_JS, anchor, limit) or {}
+
+        rows = result.get('messages') or []
+        if rows and rows[-1].get('id'):
+            self.scan_anchors[self.active_chat] = rows[-1]['id']
+
+        incoming = [row for row in rows if row.get('direction') == 'in']
+        if not (anchor and result.get('found')):
+            # First look at this chat (or the anchor scrolled away): only the latest ones count
+            incoming = incoming[-first_visit:]
+
+        new_messages = []
+        for row in incoming:
+            text = self.clean_message_text((row.get('text') or '').strip())
+            if text:
+                self.log(f" ✅ Found message: {text[:60]}...", Colors.GREEN)
+                new_messages.append({'text': text, 'hash': self.message_key(self.active_chat, row, text),
+                                     'id': row.get('id'), 'chat': self.active_chat, 'media': bool(row.get('media'))})
+        return new_messages
+
+    def fetch_recent_messages(self, limit=10):
+        """Read the last `limit` bubbles (direction, id, text, timestamp, sender) in one roundtrip"""
+        raw = self.driver.execute_script(EXTRACT_MESSAGES_JS, limit) or []
+        messages = []
+        for item in raw:
+            text = self.clean_message_text((item.get('text') or '').strip())
+            if text:
+                item['text'] = text
+                messages.append(item)
+        return messages
+
+    def clean_message_text(self, text):
+        """Drop timestamps and stray short lines from a bubble's text"""
+        lines = text.split('\n')
+        clean_lines = [line.strip() for line in lines
+                      if line.strip() and not line.strip().isdigit()
+                      and len(line.strip()) > 2]
+        return ' '.join(clean_lines) if clean_lines else text
+
+    def install_message_observer(self):
+        """Inject the MutationObserver that queues new incoming bubbles page-side"""
+        try:
+            self.driver.execute_script(MESSAGE_OBSERVER_JS)
+            return True
+        except Exception as e:
+            self.log(f" ⚠️ Could not install message observer: {e}", Colors.YELLOW)
+            return False
+
+    def wait_for_new_messages(self, timeout=20):
+        """Long-poll the page-side queue; returns new incoming messages or None if the observer is gone"""
+        self.driver.set_script_timeout(timeout + 10)
+        batch = self.driver.execute_async_script(WAIT_FOR_MESSAGES_JS, int(timeout * 1000))
+        if batch is None:
+            return None
+
+        messages = []
+        for item in batch:
+            text = self.clean_message_text((item.get('text') or '').strip())
+            if not text:
+                continue
+            lag_ms = max(0, int(time.time() * 1000) - int(item.get('detected_at') or 0))
+            self.log(f" ✅ Found message: {text[:60]}... (+{lag_ms}ms)", Colors.GREEN)
+            chat = item.get('chat') or self.active_chat
+            messages.append({'text': text, 'hash': self.message_key(chat, item, text), 'id': item.get('id'),
+                             'chat': chat, 'media': bool(item.get('media'))})
+        return messages
+
+    def send_message(self, message, chat=None):
         """Send message with multiple fallback methods"""
+        with self.driver_lock:
+            if chat and not self.open_chat(chat):
+                self.log(f" ❌ Could not open chat '{chat}' to send", Colors.RED)
+                return False
+            return self._send_in_open_chat(message)
+
+    def fast_send(self, message, timeout=None):
+        """Insert text in one call, press Enter, and wait for the outgoing bubble instead of sleeping"""
+        timeout = timeout or self.config.get("send_timeout", 5)
+        wait_for_tick = self.config.get("send_confirm", "bubble") == "tick"
+        started = time.time()
+
+        def result(ok, stage, reason="", **extra):
+            return dict(ok=ok, stage=stage, reason=reason, elapsed_ms=int((time.time() - started) * 1000), **extra)
+
+        ordered = self.selectors.ordered('input_box')
+        try:
+            prepared = self.driver.execute_script(FAST_INSERT_JS, ordered, message, self.selectors.cached('input_box'))
+        except StaleElementReferenceException:
+            # Composer was re-rendered since the last send - resolve it again
+            self.selectors.invalidate('input_box')
+            prepared = self.driver.execute_script(FAST_INSERT_JS, ordered, message, None)
+        if not prepared or not prepared.get('ok'):
+            if prepared is not None:
+                for selector in ordered:
+                    self.selectors.count(selector, 'failures')
+            return result(False, 'insert', (prepared or {}).get('reason', 'insert script failed'))
+        if prepared.get('selector'):
+            self.selectors.record('input_box', prepared['selector'], prepared['box'])
+        else:
+            self.selectors.count(self.selectors.preferred.get('input_box'), 'hits')
+
+        prepared['box'].send_keys(Keys.RETURN)
+
+        status = {}
+        def confirmed(driver):
+            status.update(driver.execute_script(SEND_STATUS_JS, prepared.get('tail')) or {})
+            return status.get('state') == 'sent' or (status.get('state') == 'pending' and not wait_for_tick)
+
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=0.05).until(confirmed)
+        except TimeoutException:
+            return result(False, 'confirm', f"no {'sent tick' if wait_for_tick else 'outgoing bubble'} within {timeout}s",
+                          state=status.get('state', 'none'))
+        except Exception as e:
+            return result(False, 'confirm', str(e), state=status.get('state', 'none'))
+        return result(True, 'confirm', state=status['state'], id=status.get('id'))
+
+    def _send_in_open_chat(self, message):
+        """Type and send into whichever chat is open"""
+        if self.config.get("fast_send", True):
+            try:
+                self.log(f" [Fast sending: '{message[:50]}...']", Colors.CYAN)
+                self.last_send_result = self.fast_send(message)
+                self.save_selector_preferences()
+            except Exception as e:
+                self.last_send_result = {'ok': False, 'stage': 'insert', 'reason': str(e)}
+
+            outcome = self.last_send_result
+            if outcome['ok']:
+                self.log(f" ✅ Outgoing bubble confirmed in {outcome['elapsed_ms']}ms ({outcome['state']})", Colors.GREEN)
+                return True
+            self.log(f" ⚠️ Fast send failed at {outcome['stage']}: {outcome['reason']}", Colors.YELLOW)
+            if outcome['stage'] == 'confirm':
+                # Enter was already pressed - retyping could send the reply twice
+                return False
+            self.log(" [Falling back to typed send...]", Colors.WHITE)
+
+        return self._send_typed(message)
+
+    def _send_typed(self, message):
+        """Original send path: click, clear, type, Enter"""
         try:
             self.log(f" [Sending: '{message[:50]}...']", Colors.CYAN)
             time.sleep(1)
 
-            input_box = None
-            selectors = [
-                "div[contenteditable='true'][data-tab='10']",
-                "div[contenteditable='true'][role='textbox']",
-                "footer div[contenteditable='true']",
-            ]
-
-            for selector in selectors:
-                try:
-                    input_box = WebDriverWait(self.driver, 3).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                    )
-                    if input_box.is_displayed():
-                        self.log(f" [Found input box]", Colors.GREEN)
-                        break
-                except:
-                    continue
+            input_box = self.selectors.find(self.driver, 'input_box', timeout=3)
+            self.save_selector_preferences()
 
             if not input_box:
                 self.log(" ❌ Could not find input box", Colors.RED)
                 return False
+            self.log(f" [Found input box]", Colors.GREEN)
 
             self.log(" [Clicking input box...]", Colors.WHITE)
             input_box.click()
@@ -564,9 +3240,62 @@ YOUR REPLY:"""
             self.log(f" ❌ Send error: {e}", Colors.RED)
             return False
 
-    def show_approval_dialog(self, incoming_msg, suggested_reply):
-        """Show dark mode approval dialog with RepliQ logo"""
+    def install_chat_list_observer(self):
+        """Inject the observer that flags chat-list changes page-side"""
+        try:
+            return bool(self.driver.execute_script(CHAT_LIST_OBSERVER_JS))
+        except Exception as e:
+            self.log(f" ⚠️ Could not watch chat list: {e}", Colors.YELLOW)
+            return False
+
+    def wait_for_chat_activity(self, timeout=20):
+        """Long-poll the chat list; returns {'activity', 'unread'} or None if the observer is gone"""
+        self.driver.set_script_timeout(timeout + 10)
+        return self.driver.execute_async_script(WAIT_FOR_CHAT_ACTIVITY_JS, int(timeout * 1000))
+
+    def open_chat(self, title, timeout=5):
+        """Click a chat in the list and wait until its conversation pane is showing"""
+        if self.active_chat == title:
+            # The operator may have clicked another chat since; trust the page header, not the cache
+            current = self.driver.execute_script(CHAT_TITLE_JS)
+            if current == title:
+                return True
+            self.active_chat = current or None
+        try:
+            if not self.driver.execute_script(OPEN_CHAT_JS, title):
+                return False
+            WebDriverWait(self.driver, timeout, poll_frequency=0.05).until(
+                lambda d: d.execute_script(CHAT_TITLE_JS) == title
+            )
+            self.active_chat = title
+            return True
+        except Exception as e:
+            self.log(f" ⚠️ Could not open chat '{title}': {e}", Colors.YELLOW)
+            return False
+
+    def queue_chat_messages(self, messages):
+        """Append scanned messages to their chat's reply queue"""
+        for msg in messages:
+            self.chat_queues.setdefault(msg.get('chat'), deque()).append(msg)
+
+    def drain_chat_queue(self, title, check_count=0):
+        """Reply to everything queued for a chat while it is open"""
+        pending = self.chat_queues.get(title)
+        while pending:
+            self.on_new_message(pending.popleft(), check_count)
+
+    def show_approval_dialog(self, incoming_msg, suggested_reply, chat=None, candidates=None, refresh=None):
+        """Show dark mode approval dialog with RepliQ logo (filled in live from `candidates`, if given).
+
+        `refresh()` is polled while the dialog is open; when it returns
+        (message, candidates) for a newer message, the dialog switches to it
+        in place. Whatever the operator has typed is kept.
+        """
         approved_reply = [None]
+        candidates = list(candidates or [])
+        shown = [suggested_reply]
+        chosen = [0]  # slot whose text is in the text area
+        edited = [False]
 
         def send_reply():
             approved_reply[0] = text_area.get("1.0", tk.END).strip()
@@ -597,7 +3326,7 @@ YOUR REPLY:"""
         status_label.pack(side='right', padx=20, pady=15)
 
         # Incoming message section
-        incoming_label = tk.Label(root, text="📨 New Message Detected:",
+        incoming_label = tk.Label(root, text=f"📨 New Message from {chat}:" if chat else "📨 New Message Detected:",
                                 font=('Arial', 11, 'bold'),
                                 bg='#1a1a1a', fg='#FF5555', pady=10)
         incoming_label.pack(anchor='w', padx=20)
@@ -625,7 +3354,119 @@ YOUR REPLY:"""
                                             borderwidth=2, relief='solid')
         text_area.pack(fill='both', expand=True, padx=20, pady=5)
         text_area.insert("1.0", suggested_reply)
-        text_area.focus()
+
+        # Alternative candidates: click to edit one, or press its number to send it as-is
+        choice_buttons = []
+        choices_frame = tk.Frame(root, bg='#1a1a1a')
+        choices_frame.pack(fill='x', padx=20)
+        choices_hint = tk.Label(choices_frame, font=('Arial', 9), bg='#1a1a1a', fg='#888888')
+
+        def build_choices():
+            for button in choice_buttons:
+                button.destroy()
+            choice_buttons.clear()
+            choices_hint.pack_forget()
+            if len(candidates) < 2:
+                return
+            choices_hint.config(text=f"Press 1-{len(candidates)} to send a suggestion, or click one to edit it")
+            choices_hint.pack(anchor='w')
+            for candidate in candidates:
+                button = tk.Button(choices_frame, anchor='w', justify='left', wraplength=620,
+                                   font=('Courier', 9), bg='#2d2d2d', fg='#00FF00', relief='flat',
+                                   activebackground='#3d3d3d', cursor='hand2',
+                                   command=lambda slot=candidate.slot: choose(slot, edit=True))
+                button.pack(fill='x', pady=1)
+                choice_buttons.append(button)
+
+        build_choices()
+        if len(candidates) > 1:
+            root.focus_set()  # digits pick a candidate until the operator clicks into the text
+        else:
+            text_area.focus()
+
+        def show(text):
+            text_area.delete("1.0", tk.END)
+            text_area.insert("1.0", text)
+            text_area.mark_set(tk.INSERT, tk.END)
+            shown[0] = text
+
+        def choose(slot, edit=False):
+            chosen[0] = slot
+            edited[0] = False
+            show(candidates[slot].current())
+            if candidates[slot].done.is_set():
+                status_label.config(text="● Active", fg='#00FF00')
+            if edit:
+                text_area.focus()
+
+        def send_choice(slot):
+            if root.focus_get() is text_area or slot >= len(candidates) or len(candidates) < 2:
+                return  # typing a digit into the reply
+            if not candidates[slot].done.is_set():
+                # Still streaming: the text so far is partial and not yet cleaned up
+                status_label.config(text=f"● #{slot + 1} still generating...", fg='#FFAA00')
+                return
+            choose(slot)
+            if shown[0].strip():
+                send_reply()
+
+        def check_edited():
+            """True once the operator has typed over the shown suggestion"""
+            if not edited[0] and text_area.get("1.0", "end-1c") != shown[0]:
+                edited[0] = True
+                status_label.config(text="● Edited", fg='#FFAA00')
+            return edited[0]
+
+        following_active = [False]
+
+        def start_following():
+            if candidates and not following_active[0]:
+                following_active[0] = True
+                if not edited[0]:
+                    status_label.config(text="● Generating...", fg='#FFAA00')
+                root.after(50, follow_candidates)
+
+        def follow_candidates():
+            """Copy new tokens into the dialog until every candidate is done; stop filling the text once it is edited"""
+            if not candidates:
+                following_active[0] = False
+                return
+            following = candidates[chosen[0]]
+            if check_edited():
+                following.cancel()  # operator took over; the rest of this generation is not needed
+            elif following.current() != shown[0]:
+                show(following.current())
+            for button, candidate in zip(choice_buttons, candidates):
+                preview = candidate.current().strip().replace("\n", " ") or "..."
+                button.config(text=f"[{candidate.slot + 1}] {preview}")
+            if all(candidate.done.is_set() for candidate in candidates):
+                following_active[0] = False
+                if not edited[0]:
+                    status_label.config(text="● Active", fg='#00FF00')
+                return
+            root.after(50, follow_candidates)
+
+        def check_newer():
+            """Swap in a newer message and its candidates; the old candidates are already cancelled"""
+            update = refresh()
+            if update is not None:
+                check_edited()  # following may have stopped long ago; edits since then must survive the swap
+                newer_msg, newer_candidates = update
+                incoming_text.config(text=newer_msg)
+                candidates[:] = newer_candidates or []
+                chosen[0] = 0
+                build_choices()
+                if not edited[0]:
+                    show(candidates[0].current() if candidates else "")
+                if candidates:
+                    start_following()
+                elif not edited[0]:
+                    status_label.config(text="● New message - regenerating...", fg='#FFAA00')
+            root.after(200, check_newer)
+
+        start_following()
+        if refresh is not None:
+            root.after(200, check_newer)
 
         # Button frame
         button_frame = tk.Frame(root, bg='#1a1a1a')
@@ -650,10 +3491,29 @@ YOUR REPLY:"""
         cancel_btn.pack(side='left', padx=10)
 
         root.bind('<Return>', lambda e: send_reply())
+        for slot in range(9):
+            root.bind(str(slot + 1), lambda e, slot=slot: send_choice(slot))
         root.mainloop()
 
+        for candidate in candidates:
+            candidate.cancel()  # sent early, cancelled or closed: stop generating either way
+        if len(candidates) > 1:
+            # Judged on what was sent, so edits made after generation finished count too
+            sent_edited = bool(approved_reply[0]) and approved_reply[0] != candidates[chosen[0]].current().strip()
+            self.record_candidate_choice(len(candidates), chosen[0] if approved_reply[0] else None, sent_edited)
         return approved_reply[0]
 
+    def record_candidate_choice(self, shown_count, slot, edited):
+        """Count which candidate slot the operator sent (slot None: nothing sent)"""
+        for shown_slot in range(shown_count):
+            self.candidate_stats.setdefault(shown_slot, {'shown': 0, 'sent': 0, 'edited': 0})['shown'] += 1
+        if slot is not None:
+            counts = self.candidate_stats[slot]
+            counts['edited' if edited else 'sent'] += 1
+            self.log(f"🎯 Sent candidate #{slot + 1}{' (edited)' if edited else ''} — "
+                     f"slot acceptance {(counts['sent'] + counts['edited']) / counts['shown']:.0%}", Colors.CYAN)
+
+
     def monitor_messages(self):
         """Main monitoring loop with duplicate detection"""
         self.log("\n" + "="*60, Colors.CYAN)
@@ -666,65 +3526,96 @@ YOUR REPLY:"""
 
         self.monitoring = True
         check_count = 0
-        message_count = 0
+        self.message_count = 0
 
-        # Load previously replied messages
-        self.message_history = set(self.config.get("replied_messages", []))
+        event_mode = self.config.get("event_intake", True) and self.install_message_observer()
+        if event_mode:
+            self.log("⚡ Event-driven intake active (no polling)", Colors.GREEN)
+        else:
+            self.log("🔁 Polling intake active", Colors.YELLOW)
 
         while self.monitoring:
             try:
                 check_count += 1
-                if check_count % 5 == 0:
+                if check_count % (60 if self.pipeline else 5) == 0:
                     self.log(f"\n[{time.strftime('%H:%M:%S')}] Check #{check_count} - Active...", Colors.WHITE)
 
-                current_message_data = self.get_last_message()
-
-                if current_message_data:
-                    msg_text = current_message_data['text']
-                    msg_hash = current_message_data['hash']
-
-                    # ✅ CRITICAL: Check if we already replied to this message
-                    if msg_hash not in self.message_history:
-                        message_count += 1
-                        self.message_history.add(msg_hash)
-                        self.last_message_hash = msg_hash
-
-                        # Save to config so it persists
-                        self.config["replied_messages"] = list(self.message_history)
-                        self.save_config()
-
-                        self.log(f"\n{'='*60}", Colors.CYAN)
-                        self.log(f"📨 NEW MESSAGE #{message_count}", Colors.GREEN)
-                        self.log(f"{'='*60}", Colors.CYAN)
-                        self.log(f"Text: {msg_text[:100]}", Colors.WHITE)
-                        self.log(f"Hash: {msg_hash[:16]}...", Colors.YELLOW)
-
-                        self.log("\n🤖 Generating AI reply...", Colors.CYAN)
-                        suggested_reply = self.generate_reply(msg_text)
-                        self.log(f"💡 AI Suggested: '{suggested_reply}'", Colors.GREEN)
-
-                        self.log("\n⏸️ Showing approval dialog...", Colors.YELLOW)
-                        approved = self.show_approval_dialog(msg_text, suggested_reply)
-
-                        if approved:
-                            self.log(f"\n📤 User approved: '{approved}'", Colors.GREEN)
-                            self.log(" Sending message...", Colors.WHITE)
-                            success = self.send_message(approved)
-                            if success:
-                                self.log("✅ MESSAGE SENT SUCCESSFULLY!", Colors.GREEN)
-                            else:
-                                self.log("❌ SEND FAILED - Please send manually", Colors.RED)
-                            time.sleep(3)
-                        else:
-                            self.log("🚫 User cancelled", Colors.YELLOW)
-
-                        self.log("-" * 60, Colors.BLACK)
+                with self.driver_lock.after_waiters():
+                    if event_mode:
+                        new_messages = self.wait_for_new_messages(self.intake_wait_seconds())
+                        if new_messages is None:
+                            self.log(" [Message observer lost (page reload?) - reinstalling]", Colors.YELLOW)
+                            event_mode = self.install_message_observer()
+                            continue
                     else:
-                        # Message already replied to
-                        if check_count % 10 == 0:
-                            self.log(f"[{time.strftime('%H:%M:%S')}] Already replied to this message, waiting for new ones...", Colors.BLACK)
+                        new_messages = self.scan_new_messages()
+
+                for current_message_data in new_messages:
+                    self.on_new_message(current_message_data, check_count)
+                self.flush_bursts(check_count)
+
+                if not event_mode:
+                    time.sleep(self.bursts.next_wait(3))
+
+            except KeyboardInterrupt:
+                self.log("\n\n⏹️ Stopping RepliQ...", Colors.RED)
+                self.monitoring = False
+                break
 
-                time.sleep(3)
+            except Exception as e:
+                self.log(f"\n⚠️ Error in loop: {e}", Colors.RED)
+                traceback.print_exc()
+                time.sleep(5)
+
+    def monitor_all_chats(self):
+        """Multi-chat loop: visit only chats whose unread badge says something new arrived"""
+        self.log("\n" + "="*60, Colors.CYAN)
+        self.log("👀 MULTI-CHAT MONITORING STARTED - RepliQ Active", Colors.GREEN)
+        self.log("="*60, Colors.CYAN)
+        self.log("\n💡 RepliQ will open chats with unread messages by itself", Colors.WHITE)
+        self.log("💡 Keep this window open\n", Colors.WHITE)
+        self.log("-" * 60, Colors.BLACK)
+
+        self.monitoring = True
+        check_count = 0
+        self.message_count = 0
+
+        if not self.install_chat_list_observer():
+            self.log("⚠️ Chat list not found - falling back to single-chat monitoring", Colors.YELLOW)
+            return self.monitor_messages()
+
+        while self.monitoring:
+            try:
+                check_count += 1
+                with self.driver_lock.after_waiters():
+                    activity = self.wait_for_chat_activity(self.intake_wait_seconds())
+                    if activity is None:
+                        self.log(" [Chat list observer lost - reinstalling]", Colors.YELLOW)
+                        if not self.install_chat_list_observer():
+                            time.sleep(2)
+                        continue
+                if not activity.get('activity'):
+                    self.flush_bursts(check_count)
+                    continue
+
+                # The open chat never shows a badge, so check it on any list change
+                if self.active_chat is not None:
+                    with self.driver_lock:
+                        self.queue_chat_messages(self.scan_new_messages())
+                    self.drain_chat_queue(self.active_chat, check_count)
+
+                unread = activity.get('unread') or []
+                if unread:
+                    self.log(f"\n[{time.strftime('%H:%M:%S')}] {len(unread)} chat(s) with unread messages", Colors.WHITE)
+
+                for chat in unread:
+                    # Open + scan must not interleave with another stage switching chats
+                    with self.driver_lock:
+                        if not self.open_chat(chat['title']):
+                            continue
+                        self.queue_chat_messages(self.scan_new_messages(first_visit=chat['unread']))
+                    self.drain_chat_queue(chat['title'], check_count)
+                self.flush_bursts(check_count)
 
             except KeyboardInterrupt:
                 self.log("\n\n⏹️ Stopping RepliQ...", Colors.RED)
@@ -736,6 +3627,283 @@ YOUR REPLY:"""
                 traceback.print_exc()
                 time.sleep(5)
 
+    def intake_wait_seconds(self):
+        """Long-poll length: long while nothing else needs the driver, short while pipeline jobs or bursts are pending"""
+        if self.pipeline and self.pipeline.busy():
+            wait = self.config.get("intake_busy_wait_seconds", 0.25)
+        else:
+            wait = self.config.get("intake_wait_seconds", 20)
+        return self.bursts.next_wait(wait)
+
+    def on_new_message(self, current_message_data, check_count=0):
+        """Hold a detected message until its sender pauses, or dispatch it at once when debouncing is off"""
+        if self.bursts.quiet_seconds <= 0:
+            return self.dispatch_message(current_message_data, check_count)
+        if current_message_data['hash'] in self.seen_messages or current_message_data['hash'] in self.message_history:
+            return
+        held = self.bursts.add(current_message_data)
+        if held > 1:
+            self.log(f" [⏳ {held} messages in a row from {current_message_data.get('chat') or 'this chat'} - "
+                     f"waiting for a pause]", Colors.CYAN)
+
+    def typing_chats(self):
+        """Titles of chats whose contact is typing; empty if the page can't tell"""
+        markers = self.config.get("typing_indicators", ["typing", "recording audio"])
+        try:
+            with self.driver_lock:
+                return set(self.driver.execute_script(TYPING_CHATS_JS, markers) or [])
+        except Exception as e:
+            self.log(f" [⚠️ Typing check failed: {e}]", Colors.YELLOW)
+            return set()
+
+    def flush_bursts(self, check_count=0):
+        """Dispatch every held burst whose sender has paused and stopped typing"""
+        quiet = self.bursts.quiet()
+        if not quiet:
+            return
+        typing = self.typing_chats() if self.config.get("burst_watch_typing", True) else set()
+        ready = self.bursts.due(typing)
+        for chat in typing.intersection(quiet):
+            burst = self.bursts.bursts.get(chat)
+            if burst and not burst.get('typing'):
+                burst['typing'] = True
+                self.log(f" [✍️ {chat or 'Contact'} is still typing - holding the reply]", Colors.CYAN)
+        for message in ready:
+            if message.get('parts'):
+                self.log(f"\n🧺 Combined {message['parts']} messages from {message.get('chat') or 'this chat'} "
+                         f"into one reply", Colors.GREEN)
+            if not self.pipeline and message.get('chat'):
+                # Inline replies read context from whichever chat is open
+                with self.driver_lock:
+                    self.open_chat(message['chat'])
+            self.dispatch_message(message, check_count)
+
+    def dispatch_message(self, current_message_data, check_count=0):
+        """Route a detected message (or merged burst) to the pipeline, or handle it inline"""
+        if self.pipeline:
+            if self.remember_message(current_message_data, check_count):
+                job = self.track_job(dict(current_message_data))
+                job['priority'] = self.message_priority(job)
+                self.pipeline.submit(job)
+        else:
+            self.handle_new_message(current_message_data, check_count)
+
+    def track_job(self, job):
+        """Tag a job with its chat's next sequence number, folding in the chat's reply still pending, if any.
+
+        The pending job is marked superseded and its generations cancelled;
+        the returned job carries both messages, so the reply is regenerated
+        once against the combined burst and fresh context.
+        """
+        chat = job.get('chat')
+        with self.jobs_lock:
+            previous = self.chat_jobs.get(chat)
+            if previous is not None and not previous.get('finished'):
+                previous['superseded'] = True
+                for candidate in previous.get('candidates') or []:
+                    candidate.cancel()
+                job = BurstCoalescer.merge([previous, job])
+                self.supersede_stats['superseded'] += 1
+                self.log(f" [♻️ Newer message in {chat or 'this chat'} - replacing pending reply #{previous['seq']}]",
+                         Colors.CYAN)
+            job['seq'] = self.chat_sequences[chat] = self.chat_sequences.get(chat, 0) + 1
+            self.chat_jobs[chat] = job
+        return job
+
+    def newest_job(self, job):
+        """The job that replaced `job` in its chat, or `job` itself while it is current"""
+        with self.jobs_lock:
+            return self.chat_jobs.get(job.get('chat'), job) if job.get('superseded') else job
+
+    def finish_job(self, job):
+        """Mark a job answered (sent or declined), so newer messages start a fresh reply instead of replacing it"""
+        with self.jobs_lock:
+            job['finished'] = True
+            for candidate in job.get('candidates') or []:
+                candidate.cancel()  # generated after the dialog closed: nobody will read it
+
+    def remember_message(self, current_message_data, check_count=0):
+        """Record a message as handled; returns False if we already replied to it"""
+        msg_text = current_message_data['text']
+        msg_hash = current_message_data['hash']
+        hashes = current_message_data.get('hashes') or [msg_hash]  # every part of a merged burst
+
+        # ✅ CRITICAL: Check if we already replied to this message
+        if all(key in self.seen_messages or key in self.message_history for key in hashes):
+            if check_count % 10 == 0:
+                self.log(f"[{time.strftime('%H:%M:%S')}] Already replied to this message, waiting for new ones...", Colors.BLACK)
+            return False
+
+        self.message_count += 1
+        for key in hashes:
+            self.seen_messages.add(key)
+            self.message_history.add(key)
+        self.last_message_hash = msg_hash
+
+        self.log(f"\n{'='*60}", Colors.CYAN)
+        self.log(f"📨 NEW MESSAGE #{self.message_count}", Colors.GREEN)
+        self.log(f"{'='*60}", Colors.CYAN)
+        if current_message_data.get('chat'):
+            self.log(f"Chat: {current_message_data['chat']}", Colors.WHITE)
+        self.log(f"Text: {msg_text[:100]}", Colors.WHITE)
+        self.log(f"Key: {msg_hash[:16]}... (id {current_message_data.get('id') or 'n/a'})", Colors.YELLOW)
+        return True
+
+    def handle_new_message(self, current_message_data, check_count=0):
+        """Dedupe, generate, approve and send for one detected message"""
+        if not self.remember_message(current_message_data, check_count):
+            return
+        msg_text = current_message_data['text']
+
+        cache_key = self.reply_cache_key(msg_text, current_message_data.get('chat'))
+        candidates = self.instant_candidates(msg_text, cache_key)
+        if candidates:
+            suggested_reply = candidates[0].current()
+        else:
+            self.log("\n🤖 Generating AI reply...", Colors.CYAN)
+            candidates = self.new_candidates()
+            priority = self.message_priority(current_message_data)
+            reply_context = self.gather_reply_context(media=current_message_data.get('media', False))
+            if self.config.get("stream_replies", True):
+                suggested_reply = ""
+                threading.Thread(target=self.generate_candidates,
+                                 args=(msg_text, reply_context, candidates, True, priority),
+                                 name="repliq-stream", daemon=True).start()
+            else:
+                self.generate_candidates(msg_text, reply_context, candidates, streaming=False, priority=priority)
+                suggested_reply = candidates[0].current()
+
+        self.log("\n⏸️ Showing approval dialog...", Colors.YELLOW)
+        approved = self.show_approval_dialog(msg_text, suggested_reply, current_message_data.get('chat'),
+                                             candidates=candidates)
+
+        if approved:
+            self.log(f"\n📤 User approved: '{approved}'", Colors.GREEN)
+            self.log(" Sending message...", Colors.WHITE)
+            success = self.send_message(approved, current_message_data.get('chat'))
+            if success:
+                self.log("✅ MESSAGE SENT SUCCESSFULLY!", Colors.GREEN)
+                self.remember_reply(cache_key, approved)
+            else:
+                self.log("❌ SEND FAILED - Please send manually", Colors.RED)
+        else:
+            self.log("🚫 User cancelled", Colors.YELLOW)
+
+        self.log("-" * 60, Colors.BLACK)
+
+    def run_pipeline(self, monitor):
+        """Run the monitor loop as the detection stage of a ReplyPipeline"""
+        self.pipeline = ReplyPipeline(
+            self,
+            queue_size=self.config.get("pipeline_queue_size", 8),
+            generation_workers=self.config.get("generation_workers", 2),
+        )
+        self.log("🧵 Pipelined reply engine active", Colors.GREEN)
+        self.pipeline.start(monitor)
+        try:
+            self.pipeline.run_approvals()
+        except KeyboardInterrupt:
+            self.log("\n\n⏹️ Stopping RepliQ...", Colors.RED)
+        finally:
+            self.pipeline.stop()
+
+    def log_stats(self):
+        """Print cache and lookup counters collected during this session"""
+        stats = self.selectors.report()
+        if stats:
+            self.log("\n📊 Selector lookups:", Colors.CYAN)
+            for selector, counts in stats.items():
+                self.log(f"   {counts['hits']:>5} hits {counts['failures']:>4} misses  {selector}", Colors.WHITE)
+
+        images = self.image_cache.stats
+        if images['memory_hits'] + images['disk_hits'] + images['misses']:
+            self.log(f"📊 Training image cache: {self.image_cache.hit_rate():.0%} hit rate "
+                     f"({images['memory_hits']} memory, {images['disk_hits']} disk, {images['misses']} encoded), "
+                     f"{images['bytes_saved'] / 1024:.0f} KB not re-read", Colors.CYAN)
+
+        shots = self.pane_capture.stats
+        if shots['sent'] + shots['skipped']:
+            self.log(f"📊 Screenshots: {shots['sent']} sent ({shots['bytes_raw'] // 1024} KB raw -> "
+                     f"{shots['bytes_sent'] // 1024} KB uploaded), {shots['skipped']} skipped as unchanged", Colors.CYAN)
+
+        limiter = self.scheduler.stats if self.scheduler else None
+        if limiter and limiter['granted']:
+            self.log(f"📊 Rate limiter: {limiter['granted']} requests, {limiter['delayed']} delayed "
+                     f"({limiter['wait_seconds']:.1f}s total), {limiter['throttled']} quota pauses", Colors.CYAN)
+
+        bursts = self.bursts.stats
+        if bursts['messages']:
+            self.log(f"📊 Bursts: {bursts['messages']} messages answered with {bursts['bursts']} replies "
+                     f"({bursts['messages'] - bursts['bursts']} model calls and dialogs saved)", Colors.CYAN)
+
+        superseded = self.supersede_stats
+        if superseded['superseded']:
+            self.log(f"📊 Superseded: {superseded['superseded']} pending replies replaced by newer messages "
+                     f"({superseded['refreshed']} refreshed in an open dialog)", Colors.CYAN)
+
+        routes = self.router.report() if self.router else []
+        if routes:
+            self.log(f"📊 Models (latency SLO p95 ≤ {self.router.slo_ms}ms):", Colors.CYAN)
+            for line in routes:
+                self.log(f"   {line}", Colors.WHITE)
+
+        resilience = dict(self.resilience_stats, **self.breaker.stats)
+        if any(resilience.values()):
+            self.log(f"📊 Resilience: {resilience['retries']} retries, {resilience['timeouts']} timeouts, "
+                     f"{resilience['failures']} failed calls; circuit opened {resilience['opened']}x, "
+                     f"half-opened {resilience['half_opened']}x, closed {resilience['closed']}x, "
+                     f"{resilience['short_circuited']} calls answered locally (now {self.breaker.state})", Colors.CYAN)
+
+        prompts = self.prompt_budget.stats
+        if prompts['prompts']:
+            self.log(f"📊 Prompts: {prompts['prompts']} built, avg ~{prompts['text_tokens'] // prompts['prompts']} text + "
+                     f"~{prompts['image_tokens'] // prompts['prompts']} image tokens, {prompts['trimmed']} trimmed to budget "
+                     f"({prompts['lines_dropped']} context lines dropped)", Colors.CYAN)
+
+        if sum(self.local_stats.values()):
+            self.log(f"📊 Local fast path: {self.local_stats['gibberish']} gibberish, {self.local_stats['emoji']} emoji-only "
+                     f"messages answered without an API call", Colors.CYAN)
+
+        replies = self.reply_cache.stats
+        if replies['lookups']:
+            self.log(f"📊 Reply cache: {self.reply_cache.hit_rate():.0%} hit rate "
+                     f"({replies['hits']}/{replies['lookups']} lookups), {replies['calls_avoided']} API calls avoided", Colors.CYAN)
+
+        if self.candidate_stats:
+            temperatures = self.config.get("candidate_temperatures", [1.1, 0.7, 1.5])
+            self.log("📊 Reply candidates (sent as-is / edited / shown):", Colors.CYAN)
+            for slot, counts in sorted(self.candidate_stats.items()):
+                accepted = (counts['sent'] + counts['edited']) / counts['shown']
+                self.log(f"   #{slot + 1} (temperature {temperatures[slot % len(temperatures)]}): "
+                         f"{counts['sent']} / {counts['edited']} / {counts['shown']} -> {accepted:.0%} accepted", Colors.WHITE)
+
+    def run_benchmark(self, count=50, message="hey u free tmrw?"):
+        """Time generate_reply against the configured backend, with generation_workers in parallel"""
+        self.setup_llm()
+        workers = self.config.get("generation_workers", 2)
+        reply_context = {'context': "Them: hi\nYou: Hmm\nThem: kya chal raha hai", 'screenshot': None}
+        self.log(f"\n⏱️ Benchmarking {count} replies with {workers} worker(s) on {self.model.name}", Colors.CYAN)
+
+        self.quiet = True
+        latencies = []
+        def one_reply(_):
+            started = time.perf_counter()
+            self.generate_reply(message, reply_context)
+            latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(one_reply, range(count)))
+        finally:
+            self.quiet = False
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        self.log(f"   p50 {pick(0.50):.0f}ms | p95 {pick(0.95):.0f}ms | max {latencies[-1] * 1000:.0f}ms", Colors.GREEN)
+        self.log(f"   {count / elapsed:.2f} replies/s over {elapsed:.1f}s", Colors.GREEN)
+        return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'throughput': count / elapsed}
+
     def run(self):
         """Main execution with boot sequence"""
         LoadingAnimation.show_boot_sequence()
@@ -745,10 +3913,19 @@ YOUR REPLY:"""
         self.log("="*60 + "\n", Colors.CYAN)
 
         try:
-            self.setup_gemini()
+            self.setup_llm()
+            self.startup.mark("model")
             self.setup_training_data()
+            self.startup.mark("customization")
             self.setup_whatsapp()
-            self.monitor_messages()
+            self.log("\n⏱️ Startup breakdown:", Colors.CYAN)
+            for line in self.startup.report():
+                self.log(f"   {line}", Colors.CYAN)
+            monitor = self.monitor_all_chats if self.config.get("multi_chat", False) else self.monitor_messages
+            if self.config.get("pipeline", True):
+                self.run_pipeline(monitor)
+            else:
+                monitor()
 
         except KeyboardInterrupt:
             self.log("\n\n👋 Stopped by user", Colors.YELLOW)
@@ -758,6 +3935,8 @@ YOUR REPLY:"""
             traceback.print_exc()
 
         finally:
+            self.save_selector_preferences()
+            self.log_stats()
             if self.driver:
                 self.log("\n🔄 Closing browser...", Colors.YELLOW)
                 try:
@@ -765,8 +3944,39 @@ YOUR REPLY:"""
                 except:
                     pass
             self.log("✅ Shutdown complete", Colors.GREEN)
-            input("\nPress Enter to exit...")
+            if sys.stdin.isatty():  # no prompt when running as a service
+                input("\nPress Enter to exit...")
 
 if __name__ == "__main__":
-    bot = WhatsAppAIBot()
-    bot.run()
+    parser = argparse.ArgumentParser(description="RepliQ - AI WhatsApp bot")
+    parser.add_argument("--mock-llm", action="store_true", help="serve the local OpenAI-compatible stub and exit on Ctrl+C")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--mock-latency-ms", type=int, default=400)
+    parser.add_argument("--mock-token-ms", type=int, default=40, help="gap between streamed tokens")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="time N replies against the configured backend")
+    parser.add_argument("--eval-classifier", action="store_true", help="precision/recall of the local gibberish/emoji check")
+    args = parser.parse_args()
+
+    if args.mock_llm:
+        mock = MockLLMServer(port=args.mock_port, latency_ms=args.mock_latency_ms,
+                             token_ms=args.mock_token_ms).start()
+        print(f"Mock LLM listening on {mock.url} (Ctrl+C to stop)", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            mock.stop()
+    elif args.eval_classifier:
+        classifier = MessageClassifier()
+        for title, corpus in (("Tuning set", CLASSIFIER_CORPUS), ("Held-out set", CLASSIFIER_HELDOUT)):
+            report, errors, per_call_us = classifier.evaluate(corpus)
+            print(f"{title} ({len(corpus)} messages, {per_call_us:.1f} µs each):")
+            for label, scores in report.items():
+                print(f"{label:>10}: precision {scores['precision']:.2f}  recall {scores['recall']:.2f}  ({scores['support']} labeled)")
+            for truth, guess, text in errors:
+                print(f"  expected {truth:<9} got {guess:<9} {text!r}")
+    elif args.benchmark:
+        WhatsAppAIBot().run_benchmark(args.benchmark)
+    else:
+        bot = WhatsAppAIBot()
+        bot.run()
@@ -16,6 +16,7 @@ import google.generativeai as genai
 from PIL import Image
 import io
 import traceback
+import hashlib
 
 class WhatsAppAIBot:
     def __init__(self):
@@ -464,9 +465,11 @@ YOUR REPLY:"""
             # Get message ID
             msg_id = last_msg.get_attribute('data-id')
             if not msg_id:
-                # Fallback: use text hash as ID
-                text_preview = last_msg.text[:30]
-                msg_id = str(hash(text_preview + str(time.time())))
+                # Fallback: sender/timestamp stamp + text is stable across polls
+                # (mixing in time.time() made every poll look like a new message)
+                stamps = last_msg.find_elements(By.CSS_SELECTOR, "[data-pre-plain-text]")
+                stamp = stamps[0].get_attribute('data-pre-plain-text') if stamps else ""
+                msg_id = hashlib.sha1((stamp + last_msg.text).encode('utf-8')).hexdigest()
             
             # Extract text content
             text_elements = last_msg.find_elements(By.CSS_SELECTOR, 